@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Restaurant Depot export parsing and queue join on a synthetic
+Allitems.csv, comparing the previous dict + list(keys) join with
+the streaming reader and hash join of depot_export.
+
+    python3 benchmarks/depot_export.py --rows 100000 --queued 2000
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from depot_export import join_queued, read_depot_export  # noqa: E402
+
+
+def write_export(path, rows):
+    """Synthetic export: header, items with case price rows and unavailable items, Total row"""
+    upcs = []
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for n in range(10):
+            writer.writerow(['Shopping list header %s' % n] + [''] * 7)
+        for n in range(rows):
+            upc = str(70000000000 + n)
+            upcs.append(upc)
+            if n % 50 == 0:
+                writer.writerow([upc, '', 'Item %s' % n, '', '', '', '1', 'N/A'])
+                continue
+            writer.writerow([upc, '', 'Item %s' % n, '', '', '', '1', '$%0.2f' % (n % 900 + 1.5)])
+            if n % 3 == 0:
+                writer.writerow(['', '', '', '', '', '', '6', '$%0.2f' % (6 * (n % 900 + 1.25))])
+        writer.writerow(['', '', '', '', '', 'Total:', '', ''])
+    return upcs
+
+
+def legacy(path, products):
+    """The parser and join used before depot_export"""
+    data = {}
+    with open(path, newline='') as f:
+        count = 1
+        old_upc = ''
+        for row in csv.reader(f):
+            if count > 10:
+                if row[5] == 'Total:':
+                    break
+                if row[7] == 'N/A':
+                    if row[0]:
+                        upc = row[0]
+                        old_upc = row[0]
+                    else:
+                        upc = old_upc
+                    data[upc] = {'not_available': True}
+                    continue
+                qty = float(row[6])
+                price = float(row[7].strip('$').replace(',', ''))
+                unit_price = price
+                if qty > 0:
+                    unit_price = price / qty
+                if not row[0]:
+                    data[old_upc]['case_price'] = unit_price
+                else:
+                    data[row[0]] = {'name': row[2], 'unit_price': unit_price, 'not_available': False}
+                    old_upc = row[0]
+            count += 1
+    return {sku: data[sku] for sku in list(products.keys()) if sku in list(data.keys())}
+
+
+def streaming(path, products):
+    return join_queued(read_depot_export(path), products)
+
+
+def measure(label, func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('%-22s %8.3f s  peak %8.1f MiB  matched %s' % (label, elapsed, peak / 2 ** 20, len(result)))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='items in the export (default 100000)')
+    parser.add_argument('--queued', type=int, default=2000, help='queued SKUs to join (default 2000)')
+    parser.add_argument('--skip-legacy', action='store_true', help='only run the streaming reader')
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'Allitems.csv')
+        upcs = write_export(path, options.rows)
+        queued = random.sample(upcs, min(options.queued, len(upcs))) + ['missing-%s' % n for n in range(10)]
+        products = {sku: (n, 1, False) for n, sku in enumerate(queued)}
+
+        new = measure('streaming + hash join', streaming, path, products)
+        if not options.skip_legacy:
+            old = measure('dict + list(keys) join', legacy, path, products)
+            assert set(old) == set(new)
+
+
+if __name__ == '__main__':
+    main()
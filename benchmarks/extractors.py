@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Parse time and correctness of the competitor extractors over
+captured product pages.
+
+Fixtures live in benchmarks/fixtures/<competitor>/*.html next to
+an expected.json holding the name and unit price of every page,
+or the missing field for pages that must raise LayoutChanged.
+Exits non-zero when a page is extracted wrongly or is slower
+than --max-ms, so it can guard against regressions offline.
+
+    python3 benchmarks/extractors.py --repeat 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from extractors import EXTRACTORS, LayoutChanged  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def check(extractor, page_source, expected):
+    """Compare one extraction against its expected.json entry, returns an error message or None"""
+    try:
+        item = extractor.extract(page_source)
+    except LayoutChanged as e:
+        if expected.get('error') == e.field:
+            return None
+        return 'unexpected %s' % e
+    if 'error' in expected:
+        return 'expected LayoutChanged on %s, got %s' % (expected['error'], item)
+    if item.name != expected['name'] or item.unit_price != expected['unit_price']:
+        return 'got %r %r' % (item.name, item.unit_price)
+    return None
+
+
+def timed(extractor, page_source, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            extractor.extract(page_source)
+        except LayoutChanged:
+            pass
+    return 1000 * (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixtures', default=FIXTURES, help='fixture directory (default benchmarks/fixtures)')
+    parser.add_argument('--repeat', type=int, default=100, help='extractions per page (default 100)')
+    parser.add_argument('--max-ms', type=float, default=0, help='fail when a page takes longer (default off)')
+    options = parser.parse_args()
+
+    failures = 0
+    for competitor in sorted(os.listdir(options.fixtures)):
+        directory = os.path.join(options.fixtures, competitor)
+        if competitor not in EXTRACTORS or not os.path.isdir(directory):
+            continue
+        extractor = EXTRACTORS[competitor]
+        with open(os.path.join(directory, 'expected.json')) as f:
+            expected = json.load(f)
+        for page in sorted(name for name in os.listdir(directory) if name.endswith('.html')):
+            with open(os.path.join(directory, page), 'rb') as f:
+                page_source = f.read()
+            error = check(extractor, page_source, expected.get(page, {}))
+            ms = timed(extractor, page_source, options.repeat)
+            if not error and options.max_ms and ms > options.max_ms:
+                error = 'slower than %s ms' % options.max_ms
+            failures += bool(error)
+            print('%-8s %-28s %8.3f ms/page  %s' % (competitor, page, ms, error or 'ok'))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
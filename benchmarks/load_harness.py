@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end load test of web_scraping.py.
+
+Starts a stand-in Odoo XML-RPC server implementing the models the
+script uses, with a configurable latency per call, and fake
+Restaurant Depot and Webstaurant sites serving the login form, the
+shopping list export and product pages. Then runs the real entry
+point against them with a queue of --skus SKUs and reports SKUs per
+minute, XML-RPC calls per model and method, and the time spent per
+stage as collected on the script's metrics endpoint.
+
+Restaurant Depot and Webstaurant SKUs without a product link need
+Firefox and geckodriver, like production. With --rdepot-share 0 and
+--linked-share 1 everything goes over HTTP and no browser is needed.
+
+    python3 benchmarks/load_harness.py --skus 10000 --latency 0.02
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_scraping.py')
+
+POLL_INTERVAL = 10
+WEBSTAURANT_SEARCH_BUTTON = ('text-white hidden rounded-r border-0 box-border text-sm py-2.5 px-4-1/2 lt:flex '
+                             'lt:items-center cursor-pointer bg-blue-700 lt:hover:bg-blue-800 tracking-[.02em]')
+
+
+class FakeOdoo:
+    """
+    In-memory stand-in for the Odoo models used by the script.
+    Only the domain leaves the script sends are understood.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.configs = []
+        self.references = {}
+        self.schedules = {}
+        self.prices = []
+        self.exceptions = 0
+
+    def value(self, record, path):
+        field, _, rest = path.partition('.')
+        value = record.get(field)
+        if rest:
+            return self.value(self.references[value], rest)
+        return value
+
+    def match(self, record, domain):
+        for field, operator, expected in domain:
+            value = self.value(record, field)
+            if operator == '=' and value != expected or \
+                    operator == 'in' and value not in expected or \
+                    operator == '>' and not value > expected or \
+                    operator == '>=' and not value >= expected:
+                return False
+        return True
+
+    def records(self, model):
+        return {
+            'website.scraping.cofig': dict(enumerate(self.configs, 1)),
+            'product.sku.reference': self.references,
+            'price.fetch.schedule': self.schedules,
+            'competitor.website.price': dict(enumerate(self.prices, 1)),
+        }[model]
+
+    def export(self, model, record_id, record, fields):
+        row = {'id': record_id}
+        for field in fields:
+            if field == 'id':
+                continue
+            value = record.get(field, False)
+            if field == 'product_sku_ref_id' and value:
+                value = [value, self.references[value]['competitor_sku']]
+            row[field] = value
+        return row
+
+    def execute(self, db, uid, password, model, method, *args):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[model, method] += 1
+            records = self.records(model)
+            if method in ('search_read', 'search'):
+                domain = args[0] if args else []
+                offset = args[2] if len(args) > 2 else 0
+                limit = args[3] if len(args) > 3 else None
+                ids = sorted(record_id for record_id, record in records.items()
+                             if self.match(dict(record, id=record_id), domain))
+                ids = ids[offset:offset + limit if limit else None]
+                if method == 'search':
+                    return ids
+                fields = args[1] if len(args) > 1 else []
+                return [self.export(model, record_id, records[record_id], fields) for record_id in ids]
+            if method == 'read':
+                return [self.export(model, record_id, records[record_id], args[1])
+                        for record_id in args[0] if record_id in records]
+            if method == 'create':
+                values = args[0] if isinstance(args[0], list) else [args[0]]
+                self.prices.extend(values)
+                return list(range(len(self.prices) - len(values) + 1, len(self.prices) + 1))
+            if method == 'write':
+                for record_id in args[0]:
+                    records[record_id].update(args[1])
+                return True
+            if method == 'unlink':
+                for record_id in args[0]:
+                    records.pop(record_id, None)
+                return True
+            if method == 'log_exception_error':
+                for record_id in args[0] if isinstance(args[0], list) else [args[0]]:
+                    self.references[record_id]['in_exception'] = True
+                    self.exceptions += 1
+                return True
+        raise ValueError('%s.%s is not implemented by the fake Odoo' % (model, method))
+
+    def pending(self):
+        """Schedule rows the script still has to handle"""
+        with self.lock:
+            return sum(1 for record in self.schedules.values()
+                       if not self.references[record['product_sku_ref_id']]['in_exception'])
+
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/xmlrpc/object',)
+
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class FakeSite(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    pages = {}
+
+    def reply(self, status, body=b'', content_type='text/html', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeWebstaurant(FakeSite):
+    # requests per second served before answering 429, 0 for no limit
+    max_rate = 0
+    recent = deque()
+    lock = threading.Lock()
+
+    def over_rate(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and self.recent[0] < now - 1:
+                self.recent.popleft()
+            self.recent.append(now)
+            return self.max_rate and len(self.recent) > self.max_rate
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if self.over_rate():
+            self.reply(429, b'<html><body>Too many requests</body></html>', headers=[('Retry-After', '1')])
+        elif url.path == '/':
+            self.reply(200, ('<html><body><form action="/search.html">'
+                             '<input id="searchval" name="searchval" type="text">'
+                             '<button type="submit" class="%s">Search</button>'
+                             '</form></body></html>' % WEBSTAURANT_SEARCH_BUTTON).encode())
+        elif url.path == '/search.html':
+            sku = parse_qs(url.query).get('searchval', [''])[0]
+            if sku in self.pages:
+                self.reply(302, headers=[('Location', '/product/%s.html' % sku)])
+            else:
+                self.reply(200, b'<html><body><h1>No results</h1></body></html>')
+        elif url.path.startswith('/product/') and url.path[9:-5] in self.pages:
+            self.reply(200, self.pages[url.path[9:-5]])
+        else:
+            self.reply(404, b'<html><body>Not found</body></html>')
+
+
+class FakeRestaurantDepot(FakeSite):
+    export = b''
+
+    def logged_in(self):
+        return 'session=ok' in self.headers.get('Cookie', '')
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/robots.txt':
+            self.reply(200, b'', 'text/plain')
+        elif not self.logged_in():
+            self.reply(200, b'<html><body><form method="post" action="/login">'
+                            b'<input id="email" name="email"><input id="pass" name="pass" type="password">'
+                            b'<button id="send2" type="submit">Sign In</button></form></body></html>')
+        elif path == '/list':
+            self.reply(200, b'<html><body><button id="print-export-list">Print</button>'
+                            b'<button id="export-to-excel" onclick="window.location=\'/export.csv\'">Export'
+                            b'</button></body></html>')
+        elif path == '/export.csv':
+            self.reply(200, self.export, 'text/csv',
+                       headers=[('Content-Disposition', 'attachment; filename="Allitems.csv"')])
+        else:
+            self.reply(200, b'<html><body><button class="action action-auth-toggle user-shopping-list">My Lists'
+                            b'</button><div id="header-list-item-count"><div><ol><li><a href="/list">Allitems</a>'
+                            b'</li></ol></div></div></body></html>')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.reply(302, headers=[('Location', '/'), ('Set-Cookie', 'session=ok; Path=/')])
+
+
+def product_page(sku, price):
+    return ('<html><body><h1 id="page-header-description">Product %s</h1><div class="pricing"><table>'
+            '<tr><td>1 - 2 $%.2f/Each</td></tr><tr><td>3+ $%.2f/Each</td></tr></table></div></body></html>'
+            % (sku, price, price * 0.95)).encode()
+
+
+def depot_export(upcs):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for n in range(10):
+        writer.writerow(['Restaurant Depot shopping list'] + [''] * 7)
+    for n, upc in enumerate(upcs):
+        if n % 40 == 0:
+            writer.writerow([upc, '', 'Depot item %s' % upc, '', '', '', '1', 'N/A'])
+            continue
+        writer.writerow([upc, '', 'Depot item %s' % upc, '', '', '', '1', '$%.2f' % (5 + n % 50)])
+        if n % 4 == 0:
+            writer.writerow(['', '', '', '', '', '', '6', '$%.2f' % (27 + n % 50)])
+    writer.writerow(['', '', '', '', '', 'Total:', '', ''])
+    return out.getvalue().encode()
+
+
+def start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def seed(odoo, options, webstaurant_url, depot_url):
+    odoo.configs = [
+        {'home_page_url': webstaurant_url + '/', 'username': False, 'password': False, 'competitor': 'wdepot'},
+        {'home_page_url': depot_url + '/', 'username': 'buyer@example.com', 'password': 'secret',
+         'competitor': 'rdepot'},
+    ]
+    upcs = []
+    for n in range(1, options.skus + 1):
+        competitor = 'rdepot' if random.random() < options.rdepot_share else 'wdepot'
+        sku = '%s%06d' % ('7' if competitor == 'rdepot' else 'WS', n)
+        link = False
+        if competitor == 'wdepot':
+            FakeWebstaurant.pages[sku] = product_page(sku, 10 + n % 90)
+            if random.random() < options.linked_share:
+                link = '%s/product/%s.html' % (webstaurant_url, sku)
+        elif random.random() > options.missing_share:
+            upcs.append(sku)
+        odoo.references[n] = {'competitor': competitor, 'competitor_sku': sku, 'website_link': link,
+                              'qty_in_uom': 1, 'in_exception': False}
+        odoo.schedules[n] = {'product_sku_ref_id': n, 'in_exception': False}
+    FakeRestaurantDepot.export = depot_export(upcs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--skus', type=int, default=10000, help='queued SKUs (default 10000)')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per XML-RPC call (default 0.01)')
+    parser.add_argument('--rdepot-share', type=float, default=0.2,
+                        help='share of Restaurant Depot SKUs (default 0.2)')
+    parser.add_argument('--linked-share', type=float, default=0.9,
+                        help='share of Webstaurant SKUs with a product link (default 0.9)')
+    parser.add_argument('--missing-share', type=float, default=0.02,
+                        help='share of Restaurant Depot SKUs missing from the export (default 0.02)')
+    parser.add_argument('--site-rate', type=float, default=0,
+                        help='Webstaurant requests per second answered before it returns 429 (default no limit)')
+    parser.add_argument('--host-interval', type=float, default=0,
+                        help='--host-interval of web_scraping.py, 0 lets the pace adapt upwards from its '
+                             'starting rate (default 0)')
+    parser.add_argument('--timeout', type=float, default=3600, help='give up after seconds (default 3600)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default 1)')
+    parser.add_argument('script_args', nargs='*', help='extra web_scraping.py arguments, after --')
+    options = parser.parse_args()
+    random.seed(options.seed)
+    FakeWebstaurant.max_rate = options.site_rate
+
+    odoo = FakeOdoo(options.latency)
+    odoo_server = start(ThreadedXMLRPCServer(('127.0.0.1', 0), requestHandler=RequestHandler,
+                                             logRequests=False, allow_none=True))
+    odoo_server.register_function(odoo.execute, 'execute')
+    webstaurant = start(ThreadingHTTPServer(('127.0.0.1', 0), FakeWebstaurant))
+    depot = start(ThreadingHTTPServer(('127.0.0.1', 0), FakeRestaurantDepot))
+    seed(odoo, options, 'http://127.0.0.1:%s' % webstaurant.server_address[1],
+         'http://127.0.0.1:%s' % depot.server_address[1])
+    total = odoo.pending()
+
+    home = tempfile.mkdtemp(prefix='nsa-load-')
+    os.makedirs(os.path.join(home, 'Downloads'))
+    metrics_port = free_port()
+    env = dict(os.environ, HOME=home, NSA_PASSWORD='secret', NSA_DB='load')
+    command = [sys.executable, SCRIPT, '-u', 'http://127.0.0.1:%s' % odoo_server.server_address[1],
+               '-i', str(POLL_INTERVAL), '-m', '1', '-s', '30', '--host-interval', str(options.host_interval),
+               '--metrics-port', str(metrics_port),
+               '--price-cache', ''] + options.script_args
+    print('%s queued SKUs, Odoo latency %s s, running %s' % (total, options.latency, ' '.join(command[1:])))
+
+    start_time = time.monotonic()
+    log = open(os.path.join(home, 'web_scraping.log'), 'wb')
+    script = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        while odoo.pending() and time.monotonic() - start_time < options.timeout:
+            if script.poll() is not None:
+                print('web_scraping.py exited with %s' % script.returncode)
+                break
+            time.sleep(1)
+        wall = time.monotonic() - start_time
+        # workers hand their metrics over with their reports, which the scheduler collects between polls
+        done = total - odoo.pending()
+        stages = {'counters': {}, 'timers': {}}
+        deadline = time.monotonic() + 2 * POLL_INTERVAL
+        while time.monotonic() < deadline:
+            try:
+                stages = json.load(urllib.request.urlopen('http://127.0.0.1:%s/metrics.json' % metrics_port,
+                                                          timeout=5))
+            except OSError:
+                pass
+            if sum(value for name, value in stages['counters'].items() if name.startswith('skus_total')) >= done:
+                break
+            time.sleep(1)
+    finally:
+        script.terminate()
+        script.wait()
+        log.close()
+
+    print('\nscript output in %s' % log.name)
+    print('%s of %s SKUs handled in %.1f s: %.1f SKUs/minute' % (done, total, wall, 60 * done / wall))
+    print('%s prices written, %s exceptions logged' % (len(odoo.prices), odoo.exceptions))
+    print('\nXML-RPC calls')
+    for (model, method), count in sorted(odoo.calls.items()):
+        print('  %-28s %-22s %8s' % (model, method, count))
+    print('\nstage wall time (summed over workers)')
+    for name, timer in sorted(stages['timers'].items()):
+        print('  %-60s %6s calls %9.2f s' % (name, timer['count'], timer['sum']))
+    print('\ncounters')
+    for name, value in sorted(stages['counters'].items()):
+        print('  %-60s %9s' % (name, value))
+
+
+if __name__ == '__main__':
+    main()
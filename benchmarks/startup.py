@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Startup time of web_scraping.py and of its worker processes.
+
+Measures the import of the module in a fresh interpreter, with
+and without the heavy libraries a worker needs, then how long a
+worker takes from start() until it has those libraries loaded
+and is ready for work, for each multiprocessing start method.
+
+    python3 benchmarks/startup.py --workers 8
+"""
+import argparse
+import multiprocessing as mp
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import web_scraping  # noqa: E402
+
+
+def ready(work_queue, done_queue):
+    """Worker target importing what the scraping workers use"""
+    for module in web_scraping.PRELOAD:
+        __import__(module)
+    done_queue.put(os.getpid())
+
+
+def import_time(code, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def worker_start(method, workers, settings):
+    """Seconds until each of `workers` sequentially started workers is ready"""
+    ctx = mp.get_context(method)
+    if method == 'forkserver':
+        ctx.set_forkserver_preload(['web_scraping', __name__] + web_scraping.PRELOAD)
+    work_queue, done_queue = ctx.Queue(), ctx.Queue()
+    processes = []
+    timings = []
+    for n in range(workers):
+        start = time.perf_counter()
+        process = ctx.Process(target=web_scraping.run_worker, args=(settings, ready, work_queue, done_queue))
+        process.start()
+        done_queue.get(timeout=60)
+        timings.append(time.perf_counter() - start)
+        processes.append(process)
+    for process in processes:
+        process.join()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8, help='workers started per method (default 8)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per import measurement (default 5)')
+    options = parser.parse_args()
+
+    print('interpreter + import, median of %s runs' % options.repeat)
+    for label, code in [('python only', 'pass'),
+                        ('import web_scraping', 'import web_scraping'),
+                        ('  + worker libraries', 'import web_scraping\nfor m in web_scraping.PRELOAD: __import__(m)')]:
+        print('  %-24s %8.1f ms' % (label, 1000 * import_time(code, options.repeat)))
+
+    settings = web_scraping.parse_args(['-p', 'benchmark', '-d', 'benchmark', '--price-cache', ''])
+    print('\nworker ready after start(), %s workers' % options.workers)
+    for method in ('spawn', 'fork', 'forkserver'):
+        timings = worker_start(method, options.workers, settings)
+        print('  %-12s first %8.1f ms   next ones %8.1f ms on average' %
+              (method, 1000 * timings[0], 1000 * statistics.mean(timings[1:] or timings)))
+
+
+if __name__ == '__main__':
+    main()
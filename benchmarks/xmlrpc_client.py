@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Per-call latency of the Odoo XML-RPC layer against a local
+SimpleXMLRPCServer standing in for Odoo.
+
+Compares a fresh ServerProxy per call (the old behaviour of
+web_scraping.py) with the pooled keep-alive OdooClient and
+with system.multicall batches.
+
+    python3 benchmarks/xmlrpc_client.py --calls 500 --batch 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import xmlrpc.client
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from odoo_client import OdooClient  # noqa: E402
+
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/xmlrpc/object',)
+
+
+class ThreadedServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def start_server(latency, multicall):
+    server = ThreadedServer(('127.0.0.1', 0), requestHandler=RequestHandler, logRequests=False, allow_none=True)
+
+    def execute(db, uid, password, model, method, *args):
+        if latency:
+            time.sleep(latency)
+        return [1]
+
+    server.register_function(execute, 'execute')
+    if multicall:
+        server.register_multicall_functions()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%s' % server.server_address[1]
+
+
+def measure(label, calls, func):
+    timings = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        t = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    print('%-28s %8.3f ms/call  p95 %8.3f ms  total %7.3f s' % (
+        label, 1000 * total / calls, 1000 * sorted(timings)[int(len(timings) * 0.95) - 1], total))
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=500, help='execute calls per scenario (default 500)')
+    parser.add_argument('--batch', type=int, default=20, help='calls per multicall (default 20)')
+    parser.add_argument('--latency', type=float, default=0.0, help='server side seconds per execute (default 0)')
+    options = parser.parse_args()
+
+    server, url = start_server(options.latency, multicall=True)
+    args = ('db', 2, 'pwd', 'price.fetch.schedule', 'search', [])
+
+    def fresh_proxy():
+        xmlrpc.client.ServerProxy(url + '/xmlrpc/object', allow_none=True).execute(*args)
+
+    client = OdooClient(url, 'db', 2, 'pwd', size=1)
+    before = measure('fresh ServerProxy per call', options.calls, fresh_proxy)
+    after = measure('pooled keep-alive client', options.calls, lambda: client.execute(*args[3:]))
+
+    batches = max(1, options.calls // options.batch)
+    batched = measure('multicall x%s (per batch)' % options.batch, batches,
+                      lambda: client.multicall([args[3:]] * options.batch)) / options.batch
+    print('keep-alive speedup %.1fx, multicall speedup %.1fx (per call)' % (before / after, before / batched))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Streaming reader for the Restaurant Depot shopping list export.
+
+Allitems.csv starts with a 10 line header, then has one row per
+item, optionally followed by a continuation row without UPC that
+holds the case price, and ends with a 'Total:' row.
+"""
+import csv
+import logging
+from collections import namedtuple
+
+DepotItem = namedtuple('DepotItem', ['upc', 'name', 'unit_price', 'case_price', 'not_available'])
+
+HEADER_ROWS = 10
+UPC, NAME, TOTAL, QTY, PRICE = 0, 2, 5, 6, 7
+
+logger = logging.getLogger(__name__)
+
+
+def row_unit_price(row):
+    qty = float(row[QTY])
+    price = float(row[PRICE].strip('$').replace(',', ''))
+    if qty > 0:
+        return price / qty
+    return price
+
+
+def read_depot_export(path):
+    """
+    Yield one DepotItem per UPC of the export without loading
+    the file, continuation rows are folded into their item.
+    Rows that cannot be read are logged and skipped.
+    """
+    with open(path, newline='') as f:
+        rows = csv.reader(f)
+        for _ in zip(range(HEADER_ROWS), rows):
+            pass
+
+        item = None
+        for line, row in enumerate(rows, HEADER_ROWS + 1):
+            if len(row) > TOTAL and row[TOTAL] == 'Total:':
+                break
+            if len(row) <= PRICE:
+                continue
+
+            upc = row[UPC]
+            if upc and item:
+                yield item
+                item = None
+            if not upc and not item:
+                # continuation of an item we could not read
+                continue
+
+            try:
+                if row[PRICE] == 'N/A':
+                    item = DepotItem(upc or item.upc, '', 0.0, None, True)
+                elif upc:
+                    item = DepotItem(upc, row[NAME], row_unit_price(row), None, False)
+                else:
+                    item = item._replace(case_price=row_unit_price(row))
+            except ValueError as e:
+                logger.warning("Skipping unreadable row %s of %s: %s" % (line, path, e))
+                if upc:
+                    # and the continuation rows of that item
+                    item = None
+        if item:
+            yield item
+
+
+def join_queued(items, products):
+    """
+    Hash join of the export with the queued products keyed by
+    competitor SKU. Only matches are kept so memory follows the
+    queue, not the export; a later row for the same UPC wins.
+    """
+    matched = {}
+    for item in items:
+        if item.upc in products:
+            matched[item.upc] = item
+    return matched
@@ -0,0 +1,132 @@
+"""
+Price extractors for competitor product pages.
+
+Each competitor registers one extractor holding precompiled
+lxml XPath expressions. A page that no longer matches them
+raises LayoutChanged instead of an arbitrary parsing error.
+"""
+import re
+from collections import namedtuple
+
+import lxml.html
+from lxml import etree
+
+ItemPrice = namedtuple('ItemPrice', ['name', 'unit_price', 'tiers'])
+
+PRICE_RE = re.compile(r'\$\s*((?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?)')
+QTY_RE = re.compile(r'(\d+)')
+
+EXTRACTORS = {}
+
+
+class LayoutChanged(Exception):
+    """The page does not match the selectors of its extractor anymore"""
+
+    def __init__(self, competitor, field, detail='', url=None):
+        self.competitor = competitor
+        self.field = field
+        self.detail = detail
+        self.url = url
+        message = "%s page layout changed: no %s" % (competitor, field)
+        if detail:
+            message += " (%s)" % detail
+        if url:
+            message += " at %s" % url
+        super().__init__(message)
+
+
+def register(cls):
+    """Class decorator adding an extractor instance to the registry"""
+    EXTRACTORS[cls.competitor] = cls()
+    return cls
+
+
+def get_extractor(competitor):
+    return EXTRACTORS[competitor]
+
+
+def parse_price(text):
+    """
+    Strict dollar amount parser, '$1,234.50/Each' gives 1234.5.
+    The last amount wins, 'Was $15 Now $12.50' gives 12.5.
+    Raises ValueError when the text holds no price.
+    """
+    amounts = PRICE_RE.findall(text)
+    if not amounts:
+        raise ValueError("no price in %r" % text.strip())
+    return float(amounts[-1].replace(',', ''))
+
+
+def parse_tier(text):
+    """
+    Quantity break and price of a tiered pricing row such as
+    '1 - 2 $12.50/Each' or '3+ $11.00/Each'. The quantity is
+    1 when the row only holds a price.
+    """
+    price = parse_price(text)
+    qty = QTY_RE.match(text.strip())
+    return int(qty.group(1)) if qty else 1, price
+
+
+def parse_html(page_source):
+    if isinstance(page_source, str):
+        # lxml refuses str input that carries an encoding declaration
+        page_source = page_source.encode('utf-8')
+    return lxml.html.fromstring(page_source)
+
+
+class Extractor:
+    """Base class, subclasses set `competitor` and implement extract()"""
+    competitor = None
+
+    def extract(self, page_source, url=None):
+        raise NotImplementedError
+
+
+@register
+class WebstaurantExtractor(Extractor):
+    competitor = 'wdepot'
+
+    pricing = etree.XPath("//div[contains(concat(' ', normalize-space(@class), ' '), ' pricing ')]")
+    rows = etree.XPath(".//tr[td]")
+    # plain str results, smart strings keep the tree alive and cannot be marshalled over XML-RPC
+    row_text = etree.XPath("normalize-space(td[1])", smart_strings=False)
+    single_price = etree.XPath("normalize-space(.//p[1])", smart_strings=False)
+    name = etree.XPath("normalize-space(//h1[@id='page-header-description'])", smart_strings=False)
+
+    def challenge(self, page_source):
+        """
+        True when the page is a captcha or bot check served instead
+        of the product page. Product pages may embed a captcha of
+        their own, e.g. in a review form, so only a page without a
+        pricing block counts.
+        """
+        marker = 'captcha' if isinstance(page_source, str) else b'captcha'
+        if marker not in page_source.lower():
+            return False
+        return not self.pricing(parse_html(page_source))
+
+    def extract(self, page_source, url=None):
+        """
+        Name, unit price and quantity tiers of a product page.
+        The unit price is the highest tier, i.e. the price of one item.
+        """
+        tree = parse_html(page_source)
+        pricing = self.pricing(tree)
+        if not pricing:
+            raise LayoutChanged(self.competitor, 'pricing block', url=url)
+        pricing = pricing[0]
+
+        tiers = []
+        try:
+            for row in self.rows(pricing):
+                tiers.append(parse_tier(self.row_text(row)))
+            if not tiers:
+                text = self.single_price(pricing)
+                if text:
+                    tiers.append((1, parse_price(text)))
+        except ValueError as e:
+            raise LayoutChanged(self.competitor, 'price', detail=str(e), url=url)
+
+        unit_price = max(price for qty, price in tiers) if tiers else 0
+        return ItemPrice(self.name(tree) or False, unit_price, tiers)
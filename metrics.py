@@ -0,0 +1,152 @@
+"""
+Low overhead stage timers and counters.
+
+Every process records into its own registry with plain dict
+updates. Workers hand their deltas to the main process along
+with their done reports, the main process merges them and serves
+the totals in Prometheus text format and as JSON.
+"""
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = 'nsa_'
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Metrics:
+    """
+    Counters and stage timers keyed by name and label pairs.
+    Timers keep a count, a sum and cumulative histogram buckets.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = [0, 0.0, [0] * (len(BUCKETS) + 1)]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """Time the block as nsa_stage_seconds{stage=...}"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def take(self):
+        """Return the recorded values and start over, used by workers to ship deltas"""
+        with self.lock:
+            delta = (self.counters, self.timers)
+            self.counters = {}
+            self.timers = {}
+        return delta
+
+    def merge(self, delta):
+        counters, timers = delta
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (count, total, buckets) in timers.items():
+                timer = self.timers.get(key)
+                if timer is None:
+                    self.timers[key] = [count, total, list(buckets)]
+                    continue
+                timer[0] += count
+                timer[1] += total
+                timer[2] = [a + b for a, b in zip(timer[2], buckets)]
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted((key, (count, total, list(buckets))) for key, (count, total, buckets) in
+                            self.timers.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s%s counter' % (PREFIX, name))
+            lines.append('%s%s%s %s' % (PREFIX, name, format_labels(labels), value))
+        for (name, labels), (count, total, buckets) in timers:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s%s histogram' % (PREFIX, name))
+            cumulative = 0
+            for bound, hits in zip(BUCKETS + ('+Inf',), buckets):
+                cumulative += hits
+                lines.append('%s%s_bucket%s %s' % (PREFIX, name, format_labels(labels + (('le', bound),)),
+                                                   cumulative))
+            lines.append('%s%s_sum%s %s' % (PREFIX, name, format_labels(labels), total))
+            lines.append('%s%s_count%s %s' % (PREFIX, name, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Totals as a JSON-friendly dict, timers with their count, sum and mean"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+        return {
+            'counters': {name + format_labels(labels): value for (name, labels), value in counters},
+            'timers': {name + format_labels(labels): {'count': count, 'sum': round(total, 3),
+                                                      'mean': round(total / count, 3) if count else 0}
+                       for (name, labels), (count, total, buckets) in timers},
+        }
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels)
+
+
+def serve(registry, port, host=''):
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = registry.prometheus().encode()
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body = json.dumps(registry.summary()).encode()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+# registry of the current process
+metrics = Metrics()
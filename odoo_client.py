@@ -0,0 +1,144 @@
+"""
+Odoo XML-RPC client shared by the scraping processes.
+
+Every process gets one client holding a small pool of
+persistent HTTP/1.1 connections so that calls do not pay
+a new TCP/TLS handshake each time.
+"""
+import os
+import queue
+import ssl
+import threading
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class TimeoutMixin:
+    """Applies a socket timeout to the keep-alive connection of a transport"""
+    timeout = None
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(self.timeout)
+        return connection
+
+
+class KeepAliveTransport(TimeoutMixin, xmlrpc.client.Transport):
+    pass
+
+
+class SafeKeepAliveTransport(TimeoutMixin, xmlrpc.client.SafeTransport):
+    pass
+
+
+class OdooClient:
+    """
+    Pool of keep-alive ServerProxy objects for one Odoo database.
+
+    execute() borrows a connection from the pool for a single call,
+    multicall() batches independent execute calls into one request
+    when the server supports system.multicall and otherwise spreads
+    them over the pool.
+    """
+
+    def __init__(self, url, db, uid, password, size=4, timeout=120):
+        self.url = url.rstrip('/') + '/xmlrpc/object'
+        self.db = db
+        self.uid = uid
+        self.password = password
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.multicall_supported = None
+        self.pool = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def new_proxy(self):
+        if self.url.startswith('https'):
+            transport = SafeKeepAliveTransport(context=ssl._create_unverified_context())
+        else:
+            transport = KeepAliveTransport()
+        transport.timeout = self.timeout
+        self.created += 1
+        return xmlrpc.client.ServerProxy(self.url, transport=transport, allow_none=True)
+
+    @contextmanager
+    def proxy(self):
+        """Borrow a connection from the pool, a broken one is dropped instead of returned"""
+        try:
+            proxy = self.pool.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                proxy = self.new_proxy() if self.created < self.size else None
+            if proxy is None:
+                proxy = self.pool.get()
+        broken = False
+        try:
+            yield proxy
+        except (OSError, xmlrpc.client.ProtocolError):
+            broken = True
+            raise
+        finally:
+            if broken:
+                proxy('close')()
+                with self.lock:
+                    self.created -= 1
+            else:
+                self.pool.put(proxy)
+
+    def execute(self, model, method, *args):
+        with self.proxy() as proxy:
+            return proxy.execute(self.db, self.uid, self.password, model, method, *args)
+
+    def multicall(self, calls):
+        """
+        Run independent (model, method, *args) calls and return
+        their results in order. The first failing call raises.
+        """
+        calls = list(calls)
+        if not calls:
+            return []
+        if self.multicall_supported is not False:
+            with self.proxy() as proxy:
+                batch = xmlrpc.client.MultiCall(proxy)
+                for model, method, *args in calls:
+                    batch.execute(self.db, self.uid, self.password, model, method, *args)
+                try:
+                    results = batch()
+                except xmlrpc.client.Fault:
+                    if self.multicall_supported:
+                        raise
+                    # Odoo does not register system.multicall on /xmlrpc/object
+                    self.multicall_supported = False
+                else:
+                    self.multicall_supported = True
+                    return list(results)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='odoo-rpc')
+        return list(self.executor.map(lambda call: self.execute(*call), calls))
+
+    def close(self):
+        while not self.pool.empty():
+            self.pool.get_nowait()('close')()
+        self.created = 0
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+_clients = {}
+
+
+def get_client(url, db, uid, password, size=4, timeout=120):
+    """
+    Return the client of the current process. Forked workers must
+    not share sockets with their parent, so clients are kept per pid.
+    """
+    key = (os.getpid(), url, db, uid)
+    if key not in _clients:
+        _clients[key] = OdooClient(url, db, uid, password, size=size, timeout=timeout)
+    return _clients[key]
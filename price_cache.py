@@ -0,0 +1,73 @@
+"""
+Local cache of the last competitor price written per SKU.
+
+Lets the writeback skip creating a competitor.website.price
+record when the scraped price did not change. Kept in SQLite
+so it survives restarts and is shared by the worker processes.
+"""
+import time
+
+from sqlite_store import connect, get_store
+
+# prices closer than half a cent are considered unchanged
+PRICE_TOLERANCE = 0.005
+
+
+class PriceCache:
+    """
+    product_sku_ref_id -> (price, written timestamp) with a TTL
+    on entries and least recently used eviction above max_entries.
+    """
+
+    def __init__(self, path, max_entries=100000, ttl=30 * 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db = connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS last_price ('
+                        'product_id INTEGER PRIMARY KEY, price REAL NOT NULL, '
+                        'written REAL NOT NULL, used REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS last_price_used ON last_price (used)')
+
+    def __len__(self):
+        return self.db.execute('SELECT count(*) FROM last_price').fetchone()[0]
+
+    def get(self, product_id):
+        """(price, written) of the SKU, None when unknown or expired"""
+        row = self.db.execute('SELECT price, written FROM last_price WHERE product_id = ?',
+                              (product_id,)).fetchone()
+        now = time.time()
+        if not row or now - row[1] > self.ttl:
+            return None
+        self.db.execute('UPDATE last_price SET used = ? WHERE product_id = ?', (now, product_id))
+        return row
+
+    def unchanged(self, product_id, price, max_age):
+        """True when the same price was written less than max_age seconds ago"""
+        cached = self.get(product_id)
+        return bool(cached) and abs(cached[0] - price) < PRICE_TOLERANCE and time.time() - cached[1] < max_age
+
+    def put_many(self, prices):
+        """Record (product_id, price, written) rows, written defaults to now"""
+        now = time.time()
+        rows = [(product_id, price, written or now, now) for product_id, price, written in prices]
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.executemany('INSERT INTO last_price (product_id, price, written, used) VALUES (?, ?, ?, ?) '
+                                'ON CONFLICT (product_id) DO UPDATE SET price = excluded.price, '
+                                'written = excluded.written, used = excluded.used '
+                                'WHERE excluded.written >= last_price.written', rows)
+        self.evict()
+
+    def evict(self):
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute('DELETE FROM last_price WHERE written < ?', (time.time() - self.ttl,))
+            self.db.execute('DELETE FROM last_price WHERE product_id IN ('
+                            'SELECT product_id FROM last_price ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                            (self.max_entries,))
+
+
+def get_cache(path, max_entries=100000, ttl=30 * 86400):
+    """Return the cache of the current thread"""
+    return get_store(PriceCache, path, max_entries=max_entries, ttl=ttl)
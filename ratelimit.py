@@ -0,0 +1,124 @@
+"""
+Adaptive per-host rate limiting for the scraping workers.
+
+A token bucket in shared memory paces the requests of all
+worker processes scraping one host. Its rate adapts to how the
+host responds: it creeps up while responses are quick and clean,
+drops when latency climbs or requests fail, and halves when the
+host blocks us, pausing entirely for a Retry-After hint.
+"""
+import math
+import multiprocessing as mp
+import time
+from email.utils import parsedate_to_datetime
+
+from metrics import metrics
+
+# slots of the shared state
+RATE, NEXT_SLOT, PAUSED_UNTIL, FAST_LATENCY, SLOW_LATENCY = range(5)
+
+# smoothing of the recent and of the baseline response latency
+FAST_ALPHA = 0.3
+SLOW_ALPHA = 0.05
+# recent latency above this multiple of the baseline, and by at least the margin
+# in seconds, means the host is struggling
+SLOW_FACTOR = 2.0
+SLOW_MARGIN = 0.5
+
+RETRY_AFTER_CAP = 900
+
+# requests per second to start from and grow by when max_rate is unbounded
+UNBOUNDED_RATE = 20.0
+# the slowest pace, whatever min_rate says
+MIN_RATE = 1 / RETRY_AFTER_CAP
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header, in seconds or as a date, None when unreadable"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(int(value), RETRY_AFTER_CAP)
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return min(max(0, when - (now or time.time())), RETRY_AFTER_CAP)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket between min_rate and max_rate requests per second,
+    kept as the time its next token is due so that waiting callers
+    queue up for the following slots instead of waking together.
+    Successes add max_rate * `increase` to the rate, a slow response
+    multiplies it by `slowdown`, an error by `error_backoff` and a
+    block by `block_backoff`. An infinite max_rate stands in for
+    UNBOUNDED_RATE in the start and the steps, so the rate can still
+    fall when the host pushes back.
+    """
+
+    def __init__(self, max_rate, min_rate, burst=1, competitor='', increase=0.05, slowdown=0.8,
+                 error_backoff=0.7, block_backoff=0.5):
+        self.max_rate = max_rate
+        self.min_rate = max(MIN_RATE, min(min_rate, max_rate))
+        base_rate = max_rate if math.isfinite(max_rate) else UNBOUNDED_RATE
+        self.step = base_rate * increase
+        self.burst = max(1, burst)
+        self.competitor = competitor
+        self.increase = increase
+        self.slowdown = slowdown
+        self.error_backoff = error_backoff
+        self.block_backoff = block_backoff
+        # start halfway and earn the full rate
+        self.state = mp.Array('d', [min(self.max_rate, max(self.min_rate, base_rate / 2)), 0, 0, 0, 0])
+
+    @property
+    def rate(self):
+        return self.state[RATE]
+
+    def wait(self):
+        """Take a token, sleeping until one is free"""
+        with self.state.get_lock():
+            state = self.state
+            now = time.monotonic()
+            interval = 1 / state[RATE]
+            due = max(state[NEXT_SLOT], now)
+            # up to `burst` tokens may have piled up while nobody asked
+            slot = max(now, state[PAUSED_UNTIL], due - (self.burst - 1) * interval)
+            state[NEXT_SLOT] = max(due, slot) + interval
+        delay = slot - now
+        if delay > 0:
+            metrics.observe('stage_seconds', delay, stage='throttle', competitor=self.competitor)
+            time.sleep(delay)
+
+    def set_rate(self, rate, signal):
+        with self.state.get_lock():
+            self.state[RATE] = min(self.max_rate, max(self.min_rate, rate(self.state[RATE])))
+        metrics.inc('throttle_signals_total', competitor=self.competitor, signal=signal)
+
+    def success(self, latency):
+        """A clean response that took `latency` seconds"""
+        with self.state.get_lock():
+            state = self.state
+            if not state[SLOW_LATENCY]:
+                state[FAST_LATENCY] = state[SLOW_LATENCY] = latency
+            state[FAST_LATENCY] += FAST_ALPHA * (latency - state[FAST_LATENCY])
+            state[SLOW_LATENCY] += SLOW_ALPHA * (latency - state[SLOW_LATENCY])
+            slow = state[FAST_LATENCY] > max(SLOW_FACTOR * state[SLOW_LATENCY], state[SLOW_LATENCY] + SLOW_MARGIN)
+        if slow:
+            self.set_rate(lambda rate: rate * self.slowdown, 'slow')
+        else:
+            self.set_rate(lambda rate: rate + self.step, 'ok')
+
+    def error(self):
+        """A request that failed or timed out"""
+        self.set_rate(lambda rate: rate * self.error_backoff, 'error')
+
+    def blocked(self, retry_after=None):
+        """The host refused us: a captcha, 403, 429 or 503, optionally with a Retry-After in seconds"""
+        self.set_rate(lambda rate: rate * self.block_backoff, 'blocked')
+        if retry_after:
+            with self.state.get_lock():
+                self.state[PAUSED_UNTIL] = max(self.state[PAUSED_UNTIL], time.monotonic() + retry_after)
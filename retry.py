@@ -0,0 +1,81 @@
+"""
+Retry policies and circuit breakers for the scraping workers.
+
+A RetryPolicy retries a call with capped exponential backoff
+and full jitter. A CircuitBreaker counts consecutive failures
+of one competitor in shared memory, so all worker processes of
+that competitor stop together once it is failing.
+"""
+import multiprocessing as mp
+import random
+import time
+
+
+class RetryPolicy:
+    """
+    Up to `attempts` calls, sleeping a random time between 0 and
+    min(cap, base * 2 ** (attempt - 1)) seconds after each failure.
+    """
+
+    def __init__(self, attempts=3, base=1.0, cap=60.0, retry_on=(Exception,)):
+        self.attempts = max(1, attempts)
+        self.base = base
+        self.cap = cap
+        self.retry_on = retry_on
+
+    def delay(self, attempt):
+        """Backoff after the failed `attempt`, counted from 1"""
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+    def call(self, func, *args, on_retry=None, **kwargs):
+        """
+        Return func(*args, **kwargs), re-raising the last error once
+        the attempts are used up. on_retry(attempt, error, delay) runs
+        before each backoff, e.g. to log or to reset a browser.
+        """
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except self.retry_on as e:
+                if attempt == self.attempts:
+                    raise
+                delay = self.delay(attempt)
+                if on_retry:
+                    on_retry(attempt, e, delay)
+                time.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and refuses work
+    for `reset_timeout` seconds. After that it lets work through
+    again: a success closes it, another failure opens it again.
+    """
+
+    def __init__(self, name, threshold=5, reset_timeout=600):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = mp.Value('i', 0)
+        self.open_until = mp.Value('d', 0.0)
+
+    @property
+    def message(self):
+        return ("%s failed %s times in a row, skipped while its circuit breaker is open"
+                % (self.name, self.threshold))
+
+    def allow(self):
+        return time.monotonic() >= self.open_until.value
+
+    def success(self):
+        with self.failures.get_lock():
+            self.failures.value = 0
+
+    def failure(self):
+        """Record a failure, returns True when it opened the circuit"""
+        with self.failures.get_lock():
+            self.failures.value += 1
+            if self.failures.value < self.threshold or not self.allow():
+                return False
+            self.open_until.value = time.monotonic() + self.reset_timeout
+            return True
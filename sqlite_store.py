@@ -0,0 +1,32 @@
+"""
+SQLite files kept next to the scraper, such as the price cache
+and the product URL index.
+
+Every process and thread opens its own connection: SQLite
+connections must not cross a fork and are bound to their thread.
+WAL mode lets the worker processes read while one of them writes.
+"""
+import os
+import sqlite3
+import threading
+
+
+def connect(path):
+    """Open `path` in WAL mode with autocommit, creating its directory"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    return db
+
+
+_stores = {}
+
+
+def get_store(cls, path, **kwargs):
+    """Return the cls(path, **kwargs) instance of the current process and thread"""
+    key = (os.getpid(), threading.get_ident(), cls, path)
+    if key not in _stores:
+        _stores[key] = cls(path, **kwargs)
+    return _stores[key]
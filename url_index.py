@@ -0,0 +1,56 @@
+"""
+Local index of the product page URL of each competitor SKU.
+
+Lets the workers open a known product page directly instead of
+searching the competitor website for the SKU. Entries come from
+the website_link in Odoo and from every successful lookup. A URL
+that stopped working is remembered as bad so that the same stale
+website_link is not tried again on every run.
+"""
+import time
+
+from sqlite_store import connect, get_store
+
+
+class UrlIndex:
+    """(competitor, sku) -> product URL, or the last URL found to be bad"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS product_url ('
+                        'competitor TEXT NOT NULL, sku TEXT NOT NULL, url TEXT, bad_url TEXT, '
+                        'updated REAL NOT NULL, PRIMARY KEY (competitor, sku))')
+
+    def lookup(self, competitor, sku, link=None):
+        """
+        The URL to open for the SKU: the indexed one, else `link`
+        (the website_link) unless it is the one found bad. None
+        when the SKU has to be searched.
+        """
+        row = self.db.execute('SELECT url, bad_url FROM product_url WHERE competitor = ? AND sku = ?',
+                              (competitor, sku)).fetchone()
+        if row and row[0]:
+            return row[0]
+        if link and not (row and row[1] == link):
+            return link
+        return None
+
+    def resolved(self, competitor, sku, url):
+        """Record the product page the SKU was found on"""
+        self.upsert(competitor, sku, url, None)
+
+    def invalid(self, competitor, sku, url):
+        """Drop a URL that returned 404 or led to another product, the SKU is searched next time"""
+        self.upsert(competitor, sku, None, url)
+
+    def upsert(self, competitor, sku, url, bad_url):
+        self.db.execute('INSERT INTO product_url (competitor, sku, url, bad_url, updated) VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT (competitor, sku) DO UPDATE SET url = excluded.url, '
+                        'bad_url = excluded.bad_url, updated = excluded.updated',
+                        (competitor, sku, url, bad_url, time.time()))
+
+
+def get_index(path):
+    """Return the index of the current thread"""
+    return get_store(UrlIndex, path)
@@ -1,41 +1,75 @@
 #!/usr/bin/env python3
+"""
+Polls Odoo for queued competitor price fetches and scrapes them.
+
+Importing the module has no side effects, run main() or the
+script. Selenium, urllib3 and lxml are only imported by the
+code that needs them, worker processes are started from a fork
+server that preloaded them.
+"""
 import argparse
+import json
 import logging
 import multiprocessing as mp
 import os
 import random
-import ssl
+import signal
 import sys
+import threading
 import time
 import xmlrpc.client
 from argparse import Namespace
+from collections import Counter
 from datetime import datetime
-import csv
+from urllib.parse import quote, urljoin, urlsplit
+import queue
+
+from depot_export import join_queued, read_depot_export
+from metrics import metrics, serve as serve_metrics
+from odoo_client import get_client
+from price_cache import get_cache
+from ratelimit import AdaptiveRateLimiter, parse_retry_after
+from retry import CircuitBreaker, RetryPolicy
+from url_index import get_index
+
+# Lean browser profile
+LEAN_PREFERENCES = {
+    'permissions.default.image': 2,
+    'media.autoplay.default': 5,
+    'media.autoplay.blocking_policy': 2,
+    'gfx.downloadable_fonts.enabled': False,
+    'browser.display.use_document_fonts': 0,
+    'privacy.trackingprotection.enabled': True,
+    'privacy.trackingprotection.socialtracking.enabled': True,
+    'browser.sessionhistory.max_total_viewers': 0,
+    'browser.cache.memory.capacity': 16384,
+    'dom.ipc.processCount': 1,
+}
+BLOCK_DOMAINS = ['doubleclick.net', 'googlesyndication.com', 'googletagmanager.com', 'google-analytics.com',
+                 'googleadservices.com', 'facebook.net', 'connect.facebook.net', 'bat.bing.com', 'hotjar.com',
+                 'criteo.com', 'criteo.net', 'adnxs.com', 'taboola.com', 'outbrain.com', 'pinterest.com',
+                 'quantserve.com', 'scorecardresearch.com', 'clarity.ms', 'newrelic.com', 'nr-data.net']
+
+# imported once by the fork server, so starting a worker does not pay for them
+PRELOAD = ['selenium.webdriver', 'selenium.webdriver.support.ui', 'urllib3', 'extractors']
 
-import multiprocessing_logging
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.firefox.service import Service
-from selenium.webdriver.common.by import By
-
-# Set up logging
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-# create file handler which logs even debug messages
-# create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-# create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-# add the handlers to logger
-logger.addHandler(ch)
-multiprocessing_logging.install_mp_handler(logger=logger)
-
-# Get configuration from environmental variables or command line
-parser = argparse.ArgumentParser(description="Script to poll Odoo for scraping assignments")
+
+# settings of the running process, set by configure()
+settings = None
+
+
+def setup_logging():
+    """Log INFO and up to stderr"""
+    logger.setLevel(logging.INFO)
+    # create console handler with a higher log level
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    # create formatter and add it to the handlers
+    formatter = logging.Formatter('%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    # add the handlers to logger
+    logger.addHandler(ch)
 
 
 def environ_or_required(key):
@@ -46,260 +80,1006 @@ def environ_or_required(key):
         return {'required': True}
 
 
-try:
-    parser.add_argument('-a', '--attached', dest='headless', action='store_false', default=True,
-                        help='Run in a browser window (default is headless)')
-
-    parser.add_argument('-u', '--url', dest='url', default=os.environ.get("NSA_XMLRPC_URI",
-                                                                          'http://localhost:8069'),
-                        help="XML-RPC host URL (default http://localhost:8069)")
-    parser.add_argument('-l', '--login', dest='login', default=os.environ.get("NSA_USER",
-                                                                              2),
-                        help='user UID as an integer (default 1)', type=int)
-    parser.add_argument('-p', '--password', dest='pwd', help='the password to login to Odoo (required)',
-                        **environ_or_required("NSA_PASSWORD"))
-
-    parser.add_argument('-d', '--database', dest='db', help='Odoo database (required)',
-                        **environ_or_required("NSA_DB"))
-
-    parser.add_argument('-i', '--interval', dest="poll_interval", default=os.environ.get("NSA_POLL_INTERVAL",
-                                                                                         120),
-                        type=int, help='interval to poll for work (default 120 sec)')
-    parser.add_argument('-o', '--download-dir', dest="download_directory", default=os.environ.get("NSA_DOWNLOAD_DIR",
-                                        os.environ.get("HOME") + "/Downloads"),
-                                help="Download directory for browser. Default is $HOME/Downloads")
-    parser.add_argument('-s', '--depot-sleep-time', dest="depot_sleep_time", type=int, default=75,
-                                help="how long should we wait for Depot pages to load in seconds. Default 75.")
-
-    env_depot_sleep_time: int = 0
+def parse_args(argv=None):
+    """Configuration from the command line or environmental variables"""
+    parser = argparse.ArgumentParser(description="Script to poll Odoo for scraping assignments")
     try:
-        env_depot_sleep_time = int(os.environ.get("NSA_DEPOT_SLEEP_TIME", 0))
-    except ValueError as e:
-        logger.error("Environmental variable NSA_DEPOT_SLEEP_TIME is not an integer. Exiting.")
-        logger.debug(e)
+        parser.add_argument('-a', '--attached', dest='headless', action='store_false', default=True,
+                            help='Run in a browser window (default is headless)')
+
+        parser.add_argument('-u', '--url', dest='url', default=os.environ.get("NSA_XMLRPC_URI",
+                                                                              'http://localhost:8069'),
+                            help="XML-RPC host URL (default http://localhost:8069)")
+        parser.add_argument('-l', '--login', dest='login', default=os.environ.get("NSA_USER",
+                                                                                  2),
+                            help='user UID as an integer (default 1)', type=int)
+        parser.add_argument('-p', '--password', dest='pwd', help='the password to login to Odoo (required)',
+                            **environ_or_required("NSA_PASSWORD"))
+
+        parser.add_argument('-d', '--database', dest='db', help='Odoo database (required)',
+                            **environ_or_required("NSA_DB"))
+
+        parser.add_argument('-i', '--interval', dest="poll_interval", default=os.environ.get("NSA_POLL_INTERVAL",
+                                                                                             120),
+                            type=int, help='longest interval to poll for work when idle, the whole queue is '
+                                           're-read at this interval (default 120 sec)')
+        parser.add_argument('-m', '--min-interval', dest="min_poll_interval", type=int,
+                            default=os.environ.get("NSA_MIN_POLL_INTERVAL", 5),
+                            help='interval to poll for new work while work keeps arriving (default 5 sec)')
+        parser.add_argument('--page-size', dest="page_size", type=int,
+                            default=os.environ.get("NSA_QUEUE_PAGE_SIZE", 500),
+                            help='queued fetches read from Odoo per request (default 500)')
+        parser.add_argument('-o', '--download-dir', dest="download_directory", default=os.environ.get("NSA_DOWNLOAD_DIR",
+                                            os.environ.get("HOME") + "/Downloads"),
+                                    help="Download directory for browser. Default is $HOME/Downloads")
+        parser.add_argument('-s', '--depot-sleep-time', dest="depot_sleep_time", type=int, default=75,
+                                    help="how long should we wait at most for Depot pages and the export "
+                                         "to load in seconds. Default 75.")
+        parser.add_argument('-f', '--flush-size', dest="flush_size", type=int,
+                            default=os.environ.get("NSA_FLUSH_SIZE", 50),
+                            help="number of scrape results to buffer before writing back to Odoo. Default 50.")
+        parser.add_argument('-F', '--flush-interval', dest="flush_interval", type=int,
+                            default=os.environ.get("NSA_FLUSH_INTERVAL", 60),
+                            help="maximum seconds between writebacks to Odoo. Default 60.")
+        parser.add_argument('--writeback-depth', dest="writeback_depth", type=int,
+                            default=os.environ.get("NSA_WRITEBACK_DEPTH", 2),
+                            help="batches a worker may have waiting for Odoo before scraping pauses. Default 2.")
+        parser.add_argument('--rpc-pool-size', dest="rpc_pool_size", type=int,
+                            default=os.environ.get("NSA_RPC_POOL_SIZE", 4),
+                            help="keep-alive XML-RPC connections per process. Default 4.")
+        parser.add_argument('--rpc-timeout', dest="rpc_timeout", type=int,
+                            default=os.environ.get("NSA_RPC_TIMEOUT", 120),
+                            help="timeout of a single XML-RPC call in seconds. Default 120.")
+        parser.add_argument('-w', '--workers', dest="workers", type=int,
+                            default=os.environ.get("NSA_WORKERS", 1),
+                            help="number of browser workers scraping Webstaurant in parallel. Default 1.")
+        parser.add_argument('--host-interval', dest="host_interval", type=float,
+                            default=os.environ.get("NSA_HOST_INTERVAL", 2),
+                            help="minimum seconds between page loads on one website, shared by all workers. "
+                                 "The pace adapts between this and --max-host-interval. 0 removes the minimum, "
+                                 "the pace then starts at 10 page loads per second and speeds up while the "
+                                 "website keeps up. Default 2.")
+        parser.add_argument('--max-host-interval', dest="max_host_interval", type=float,
+                            default=os.environ.get("NSA_MAX_HOST_INTERVAL", 30),
+                            help="seconds between page loads the pace slows down to at most when a website "
+                                 "gets slow, fails or blocks us, 0 for no limit. Default 30.")
+        parser.add_argument('--price-cache', dest="price_cache_path",
+                            default=os.environ.get("NSA_PRICE_CACHE", os.environ.get("HOME") + "/price_cache.sqlite"),
+                            help="SQLite file caching the last price written per SKU, empty to disable. "
+                                 "Default is $HOME/price_cache.sqlite")
+        parser.add_argument('--price-heartbeat', dest="price_heartbeat", type=float,
+                            default=os.environ.get("NSA_PRICE_HEARTBEAT", 168),
+                            help="hours after which an unchanged price is written again anyway. Default 168.")
+        parser.add_argument('--price-cache-ttl', dest="price_cache_ttl", type=float,
+                            default=os.environ.get("NSA_PRICE_CACHE_TTL", 720),
+                            help="hours a cached price is kept. Default 720.")
+        parser.add_argument('--price-cache-size', dest="price_cache_size", type=int,
+                            default=os.environ.get("NSA_PRICE_CACHE_SIZE", 100000),
+                            help="number of SKUs kept in the price cache. Default 100000.")
+        parser.add_argument('--url-index', dest="url_index_path",
+                            default=os.environ.get("NSA_URL_INDEX", os.environ.get("HOME") + "/url_index.sqlite"),
+                            help="SQLite file keeping the product page URL of each SKU so known products are "
+                                 "opened directly instead of searched, empty to disable. "
+                                 "Default is $HOME/url_index.sqlite")
+        parser.add_argument('--session-dir', dest="session_dir",
+                            default=os.environ.get("NSA_SESSION_DIR", os.environ.get("HOME") + "/sessions"),
+                            help="directory keeping the browser cookies of each competitor so a new browser "
+                                 "can skip the login form. Default is $HOME/sessions")
+        parser.add_argument('--metrics-port', dest="metrics_port", type=int,
+                            default=os.environ.get("NSA_METRICS_PORT", 9464),
+                            help="port serving /metrics (Prometheus) and /metrics.json, 0 to disable. Default 9464.")
+        parser.add_argument('--browser-only', dest="http_first", action='store_false',
+                            default=not os.environ.get("NSA_BROWSER_ONLY"),
+                            help="always load Webstaurant product pages in the browser instead of "
+                                 "fetching known product links over plain HTTP first")
+        parser.add_argument('--full-browser', dest="lean_browser", action='store_false',
+                            default=not os.environ.get("NSA_FULL_BROWSER"),
+                            help="load pages with images, media, web fonts and ad or analytics scripts "
+                                 "instead of the lean browser profile")
+        parser.add_argument('--block-domains', dest="block_domains",
+                            default=os.environ.get("NSA_BLOCK_DOMAINS", ','.join(BLOCK_DOMAINS)),
+                            help="comma separated domains the lean browser profile never loads. "
+                                 "Default is a list of common ad and analytics domains.")
+        parser.add_argument('--recycle-pages', dest="recycle_pages", type=int,
+                            default=os.environ.get("NSA_RECYCLE_PAGES", 500),
+                            help="restart a browser after it was used for this many SKUs, 0 never. Default 500.")
+        parser.add_argument('--recycle-rss', dest="recycle_rss", type=int,
+                            default=os.environ.get("NSA_RECYCLE_RSS", 1024),
+                            help="restart a browser once it uses more than this many MB of memory, 0 never. "
+                                 "Default 1024.")
+        parser.add_argument('--start-method', dest="start_method", choices=['forkserver', 'fork', 'spawn'],
+                            default=os.environ.get("NSA_START_METHOD", 'forkserver'),
+                            help="how worker processes are started. Default forkserver, which preloads "
+                                 "the browser and parser libraries once for all workers.")
+        parser.add_argument('--breaker-threshold', dest="breaker_threshold", type=int,
+                            default=os.environ.get("NSA_BREAKER_THRESHOLD", 5),
+                            help="consecutive failures after which a competitor is paused and its queued "
+                                 "SKUs are marked as exceptions. Default 5.")
+        parser.add_argument('--breaker-reset', dest="breaker_reset", type=int,
+                            default=os.environ.get("NSA_BREAKER_RESET", 600),
+                            help="seconds a paused competitor waits before it is tried again. Default 600.")
+
+        env_depot_sleep_time: int = 0
+        try:
+            env_depot_sleep_time = int(os.environ.get("NSA_DEPOT_SLEEP_TIME", 0))
+        except ValueError as e:
+            logger.error("Environmental variable NSA_DEPOT_SLEEP_TIME is not an integer. Exiting.")
+            logger.debug(e)
+            sys.exit(1)
+
+        args = parser.parse_args(argv)  # type: Namespace
+        args.depot_sleep_time = env_depot_sleep_time or args.depot_sleep_time
+    except Exception as e:
+        logger.error(e)
         sys.exit(1)
+    return args
 
-    args = parser.parse_args()  # type: Namespace
+
+def configure(args):
+    """
+    Set the module settings from parsed arguments. Runs in the
+    main process and again in every worker it starts.
+    """
+    global settings, url, login, pwd, db, poll_interval, min_poll_interval, page_size, headless, \
+        download_directory, depot_sleep_time, flush_size, flush_interval, writeback_depth, rpc_pool_size, \
+        rpc_timeout, workers, host_interval, max_host_interval, http_first, price_cache_path, price_heartbeat, price_cache_ttl, \
+        price_cache_size, url_index_path, session_dir, metrics_port, start_method, breaker_threshold, breaker_reset, lean_browser, \
+        block_domains, recycle_pages, recycle_rss
+    settings = args
     url = args.url
     login = args.login
     pwd = args.pwd
     db = args.db
     poll_interval = args.poll_interval
+    min_poll_interval = min(args.min_poll_interval, poll_interval)
+    page_size = max(1, args.page_size)
     headless = args.headless
     download_directory = args.download_directory
-    depot_sleep_time = env_depot_sleep_time or args.depot_sleep_time
+    depot_sleep_time = args.depot_sleep_time
+    flush_size = args.flush_size
+    flush_interval = args.flush_interval
+    writeback_depth = args.writeback_depth
+    rpc_pool_size = args.rpc_pool_size
+    rpc_timeout = args.rpc_timeout
+    workers = args.workers
+    host_interval = args.host_interval
+    max_host_interval = max(args.max_host_interval, host_interval)
+    http_first = args.http_first
+    price_cache_path = args.price_cache_path
+    price_heartbeat = args.price_heartbeat * 3600
+    price_cache_ttl = args.price_cache_ttl * 3600
+    price_cache_size = args.price_cache_size
+    url_index_path = args.url_index_path
+    session_dir = args.session_dir
+    metrics_port = args.metrics_port
+    start_method = args.start_method
+    breaker_threshold = args.breaker_threshold
+    breaker_reset = args.breaker_reset
+    lean_browser = args.lean_browser
+    block_domains = [domain.strip() for domain in args.block_domains.split(',') if domain.strip()]
+    recycle_pages = args.recycle_pages
+    recycle_rss = args.recycle_rss * 1024 * 1024
+
+
+def firefox_options():
+    """Browser Configuration"""
+    from selenium.webdriver.firefox.options import Options
+    options = Options()
+    options.headless = headless
+    if lean_browser:
+        # only the HTML matters: return once the DOM is ready and skip what only renders
+        options.page_load_strategy = 'eager'
+        for name, value in LEAN_PREFERENCES.items():
+            options.set_preference(name, value)
+        if block_domains:
+            # a proxy auto-config script sending blocked domains to a closed port
+            options.set_preference('network.proxy.type', 2)
+            options.set_preference('network.proxy.autoconfig_url', blocking_pac(block_domains))
+    return options
+
+
+def blocking_pac(domains):
+    script = ('function FindProxyForURL(url, host) {var blocked = %s; for (var i = 0; i < blocked.length; i++) '
+              '{if (dnsDomainIs(host, blocked[i]) || host == blocked[i].substring(1)) return "PROXY 127.0.0.1:9";} '
+              'return "DIRECT";}' % json.dumps(['.' + domain.lstrip('.') for domain in domains]))
+    return 'data:application/x-ns-proxy-autoconfig,' + quote(script)
+
+
+# Plain HTTP Configuration
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:102.0) Gecko/20100101 Firefox/102.0',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+}
+HTTP_TIMEOUT = {'connect': 10, 'read': 30}
+# responses telling us to back off
+BLOCKED_STATUS = (403, 429, 503)
+
+# Retry Configuration
+LOGIN_RETRY = RetryPolicy(attempts=4, base=5, cap=60)
+PAGE_RETRY = RetryPolicy(attempts=3, base=5, cap=30)
+BROWSER_RETRY = RetryPolicy(attempts=2, base=2, cap=30)
+# writes Odoo did not take are retried with the next batches, then dropped
+WRITEBACK_RETRY = RetryPolicy(attempts=5, base=2, cap=60)
 
+# Socket Connection Configuration
 
-except Exception as e:
-    logger.error(e)
-    sys.exit(1)
+def odoo():
+    """The Odoo XML-RPC client of the current process"""
+    return get_client(url, db, login, pwd, size=rpc_pool_size, timeout=rpc_timeout)
 
-# Browser Configuration
-options = Options()
-options.headless = headless
 
-# Socket Connection Configuration
+def price_cache():
+    """The last written price cache of the current thread, None when disabled"""
+    if not price_cache_path:
+        return None
+    return get_cache(price_cache_path, max_entries=price_cache_size, ttl=price_cache_ttl)
 
-socket = xmlrpc.client.ServerProxy(url + '/xmlrpc/object', context=ssl._create_unverified_context(), allow_none=True)
 
+def url_index():
+    """The product URL index of the current thread, None when disabled"""
+    if not url_index_path:
+        return None
+    return get_index(url_index_path)
 
-def odoo_writeback(create_vals, product_id, write_url=''):
+
+def wrong_product(url, landed, sku):
+    """True when the known product URL led to a page that is not the product of `sku`"""
+    if not landed or urlsplit(landed).path == urlsplit(url).path:
+        return False
+    return sku.lower() not in urlsplit(landed).path.lower()
+
+
+def warm_price_cache():
     """
-    The common method which is used to
-    write values back into the odoo instance
+    Seed an empty price cache from the prices written to Odoo
+    within the heartbeat age, in one bulk search_read
     """
-    socket = xmlrpc.client.ServerProxy(url + '/xmlrpc/object', context=ssl._create_unverified_context(),
-                                       allow_none=True)
-    if write_url:
-        write_status = socket.execute(db, login, pwd, 'product.sku.reference', 'write', product_id,
-                                      {'website_link': write_url})
-    create_status = socket.execute(db, login, pwd, 'competitor.website.price', 'create', create_vals)
+    cache = price_cache()
+    if cache is None or len(cache):
+        return
+    since = datetime.fromtimestamp(time.time() - price_heartbeat).strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        prices = odoo().execute('competitor.website.price', 'search_read', [('update_date', '>=', since)],
+                                ['product_sku_ref_id', 'item_price', 'update_date'], 0, None, 'update_date asc')
+        cache.put_many((price['product_sku_ref_id'][0], price['item_price'],
+                        time.mktime(time.strptime(price['update_date'], "%Y-%m-%d %H:%M:%S")))
+                       for price in prices if price['product_sku_ref_id'])
+        logger.info("Warmed the price cache with %s SKUs" % len(cache))
+    except Exception as e:
+        logger.error("Warming the price cache failed: %s" % e)
 
 
-def random_sleep():
+class OdooWriteback:
     """
-    This method is used to introduce a random
-    seconds of sleep time to the scraping process
+    Buffer used to write the results of a competitor
+    run back into the odoo instance in bulk.
+
+    Prices are created with a single multi-record create, the
+    schedules of the written SKUs are removed with one unlink and
+    exceptions are logged once per distinct message. A price equal
+    to the last one written is skipped until the heartbeat age.
+
+    Full buffers are handed to a writer thread over a bounded
+    queue so scraping goes on while Odoo writes. When Odoo falls
+    behind by `depth` batches, adding results blocks until it
+    catches up. flush() waits for everything queued to be written.
+
+    A record Odoo rejects for good, e.g. the price of a deleted
+    SKU, is written alone and logged as an exception of its SKU
+    so that it does not hold back the rest of the batch.
     """
-    ran_int = random.randint(0, 1)
-    if ran_int == 1:
-        nap_time = random.randint(4, 10)
-        logger.info("sleeping for %s seconds." % (nap_time))
-        time.sleep(nap_time)
 
+    def __init__(self, schedule_ids=None, size=None, interval=None, competitor='', depth=None):
+        self.odoo = odoo()
+        self.competitor = competitor
+        self.cache = price_cache()
+        # product_sku_ref_id -> price.fetch.schedule ids, as read by check_queued_fetches
+        self.schedule_ids = schedule_ids or {}
+        self.size = size or flush_size
+        self.interval = interval or flush_interval
+        self.prices = []
+        self.links = {}
+        self.done = []
+        self.exceptions = {}
+        self.last_flush = time.monotonic()
+        self.batches = queue.Queue(maxsize=max(1, depth or writeback_depth))
+        # batches handed to the writer, and the last one written without leftovers
+        self.submitted = 0
+        self.written = 0
+        self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def add_price(self, create_vals, write_url=''):
+        """Queue a competitor.website.price record, its SKU is unscheduled once written"""
+        product_id = create_vals['product_sku_ref_id']
+        if self.cache and self.cache.unchanged(product_id, create_vals['item_price'], price_heartbeat):
+            logger.info("Price of product %s unchanged, skipping write" % product_id)
+            metrics.inc('prices_unchanged_total', competitor=self.competitor)
+            self.done.append(product_id)
+        else:
+            self.prices.append(create_vals)
+        if write_url:
+            self.links[product_id] = write_url
+        self.maybe_flush()
+
+    def add_exception(self, product_id, message):
+        """Queue an exception to be logged on the product.sku.reference"""
+        self.exceptions.setdefault(message, []).append(product_id)
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if batch_size(self.prices, self.done, self.exceptions) >= self.size or \
+                time.monotonic() - self.last_flush >= self.interval:
+            self.submit()
+
+    def mark(self):
+        """Number of the batch that will hold everything added so far"""
+        return self.submitted + 1
+
+    def is_written(self, mark):
+        return self.written >= mark
+
+    def submit(self):
+        """Hand the buffer to the writer thread, blocks while `depth` batches are waiting"""
+        self.last_flush = time.monotonic()
+        self.submitted += 1
+        batch = (self.submitted, self.prices, self.links, self.done, self.exceptions)
+        self.prices, self.links, self.done, self.exceptions = [], {}, [], {}
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_batches, name='%s-writeback' % self.competitor,
+                                           daemon=True)
+            self.writer.start()
+        with metrics.timer('writeback_wait', competitor=self.competitor):
+            self.batches.put(batch)
+
+    def flush(self):
+        """
+        Write everything buffered so far and wait for it. Anything
+        that could not be written stays queued for the next flush.
+        """
+        self.submit()
+        self.batches.join()
+
+    def close(self):
+        """Drain the queue and stop the writer thread"""
+        self.flush()
+        self.batches.put(None)
+        self.writer.join()
+
+    def write_batches(self):
+        """
+        Writer thread. Results that could not be written are retried
+        with the next batch after a backoff, and dropped once
+        WRITEBACK_RETRY.attempts writes in a row failed. Their SKUs stay
+        scheduled in Odoo and are fetched again by a later poll.
+        """
+        left = ([], {}, [], {})
+        failures = 0
+        while True:
+            batch = self.batches.get()
+            try:
+                if batch is None:
+                    return
+                number, *batch = batch
+                prices, links, done, exceptions = (left[0] + batch[0], {**left[1], **batch[1]},
+                                                   left[2] + batch[2], dict(left[3]))
+                for message, product_ids in batch[3].items():
+                    exceptions[message] = exceptions.get(message, []) + product_ids
+                if prices or links or done or exceptions:
+                    with metrics.timer('writeback', competitor=self.competitor):
+                        left = self.write(prices, links, done, exceptions)
+                    failures = failures + 1 if any(left) else 0
+                    if failures >= WRITEBACK_RETRY.attempts:
+                        dropped = batch_size(left[0], left[2], left[3]) + len(left[1])
+                        logger.error("Dropping %s results Odoo did not take in %s attempts" % (dropped, failures))
+                        metrics.inc('writeback_dropped_total', dropped, competitor=self.competitor)
+                        left = ([], {}, [], {})
+                        failures = 0
+                    elif failures:
+                        time.sleep(WRITEBACK_RETRY.delay(failures))
+                if not any(left):
+                    self.written = number
+            except Exception as e:
+                logger.error("Writeback to Odoo failed: %s" % e)
+            finally:
+                self.batches.task_done()
+
+    def write(self, prices, links, done, exceptions):
+        """Write one batch, returns what could not be written as (prices, links, done, exceptions)"""
+        if links:
+            calls = {product_id: ('product.sku.reference', 'write', [product_id], {'website_link': write_url})
+                     for product_id, write_url in links.items()}
+            try:
+                self.odoo.multicall(calls.values())
+                links = {}
+            except xmlrpc.client.Fault as e:
+                logger.error("Odoo rejected product links, writing them one by one: %s" % fault_message(e))
+                rejected, failed = self.write_each(calls)
+                for product_id, message in rejected.items():
+                    logger.error("Dropping the link of product %s: %s" % (product_id, message))
+                links = {product_id: links[product_id] for product_id in failed}
+            except Exception as e:
+                logger.error("Writing product links back to Odoo failed: %s" % e)
 
-def restaurant_depot_login(driver, website_config):
-    login = False
-    while not login:
-        try:
-            if 'rdepot' in website_config:
-                login_url = website_config['rdepot'][0]
-                username = website_config['rdepot'][1]
-                password = website_config['rdepot'][2]
+        if prices:
+            written = []
+            try:
+                self.odoo.execute('competitor.website.price', 'create', prices)
+                written, prices = prices, []
+            except xmlrpc.client.Fault as e:
+                logger.error("Odoo rejected %s competitor prices, writing them one by one: %s"
+                             % (len(prices), fault_message(e)))
+                rejected, failed = self.write_each(
+                    {n: ('competitor.website.price', 'create', [vals]) for n, vals in enumerate(prices)})
+                if rejected:
+                    metrics.inc('prices_rejected_total', len(rejected), competitor=self.competitor)
+                    exceptions = dict(exceptions)
+                for n, message in rejected.items():
+                    message = "Competitor price rejected by Odoo: %s" % message
+                    exceptions[message] = exceptions.get(message, []) + [prices[n]['product_sku_ref_id']]
+                written = [vals for n, vals in enumerate(prices) if n not in rejected and n not in failed]
+                prices = [prices[n] for n in failed]
+            except Exception as e:
+                logger.error("Writing competitor prices back to Odoo failed: %s" % e)
+            if written:
+                logger.info("Wrote %s competitor prices back to Odoo" % len(written))
+                metrics.inc('prices_written_total', len(written), competitor=self.competitor)
+                done = done + [vals['product_sku_ref_id'] for vals in written]
+                # SQLite connections are per thread, this one belongs to the writer
+                cache = price_cache()
+                if cache is not None:
+                    try:
+                        cache.put_many((vals['product_sku_ref_id'], vals['item_price'], None) for vals in written)
+                    except Exception as e:
+                        logger.error("Updating the price cache failed: %s" % e)
+
+        if done:
+            try:
+                schedules = [sid for product_id in done for sid in self.schedule_ids.get(product_id, [])]
+                unknown = [product_id for product_id in done if product_id not in self.schedule_ids]
+                if unknown:
+                    schedules += self.odoo.execute('price.fetch.schedule', 'search',
+                                                   [('product_sku_ref_id', 'in', unknown)])
+                if schedules:
+                    try:
+                        self.odoo.execute('price.fetch.schedule', 'unlink', schedules)
+                    except xmlrpc.client.Fault as e:
+                        # some were deleted meanwhile, unlink the ones left
+                        logger.error("Odoo rejected removing fetched SKUs from the schedule, retrying "
+                                     "with the current schedules: %s" % fault_message(e))
+                        schedules = self.odoo.execute('price.fetch.schedule', 'search',
+                                                      [('product_sku_ref_id', 'in', done)])
+                        if schedules:
+                            self.odoo.execute('price.fetch.schedule', 'unlink', schedules)
+                for product_id in done:
+                    self.schedule_ids.pop(product_id, None)
+                done = []
+            except xmlrpc.client.Fault as e:
+                # they stay scheduled and are fetched again
+                logger.error("Odoo rejected removing %s fetched SKUs from the schedule, dropping them: %s"
+                             % (len(done), fault_message(e)))
+                done = []
+            except Exception as e:
+                logger.error("Removing fetched SKUs from the schedule failed: %s" % e)
 
-                driver.get(login_url)
-                driver.implicitly_wait(40)
-                uname = driver.find_element_by_id('email')
-                uname.clear()
-                uname.send_keys(username)
+        if exceptions:
+            try:
+                self.odoo.multicall(('product.sku.reference', 'log_exception_error', product_ids, message)
+                                    for message, product_ids in exceptions.items())
+                exceptions = {}
+            except xmlrpc.client.Fault as e:
+                logger.error("Odoo rejected exceptions, logging them one by one: %s" % fault_message(e))
+                rejected, failed = self.write_each(
+                    {(message, product_id): ('product.sku.reference', 'log_exception_error', [product_id], message)
+                     for message, product_ids in exceptions.items() for product_id in product_ids})
+                for (message, product_id), reason in rejected.items():
+                    logger.error("Dropping exception %r of product %s: %s" % (message, product_id, reason))
+                exceptions = {}
+                for message, product_id in failed:
+                    exceptions.setdefault(message, []).append(product_id)
+            except Exception as e:
+                logger.error("Logging exceptions to Odoo failed: %s" % e)
+        return prices, links, done, exceptions
+
+    def write_each(self, calls):
+        """
+        Run {key: (model, method, *args)} calls one at a time after Odoo
+        rejected them together. Returns the reason of each key Odoo
+        rejects for good, and the keys not tried or not written
+        because of any other error, which stop the run.
+        """
+        rejected = {}
+        keys = list(calls)
+        for n, key in enumerate(keys):
+            try:
+                self.odoo.execute(*calls[key])
+            except xmlrpc.client.Fault as e:
+                rejected[key] = fault_message(e)
+            except Exception as e:
+                logger.error("Writing back to Odoo failed: %s" % e)
+                return rejected, keys[n:]
+        return rejected, []
 
-                pwd = driver.find_element_by_id('pass')
-                pwd.clear()
-                pwd.send_keys(password)
 
-                submit_button = driver.find_element_by_id('send2')
-                submit_button.click()
+def batch_size(prices, done, exceptions):
+    return len(prices) + len(done) + sum(len(ids) for ids in exceptions.values())
 
-                driver.implicitly_wait(60)
 
-                login = True
-        except Exception as e:
-            logger.error("Restaurant Depot login in failed. Retrying...", e)
-            pass
-    return driver
+def fault_message(fault):
+    """The error of an XML-RPC fault without the server traceback Odoo puts before it"""
+    lines = [line.strip() for line in str(fault.faultString).splitlines() if line.strip()]
+    return lines[-1] if lines else 'fault %s' % fault.faultCode
 
-def restaurant_depot_scrape(driver):
-    data = {}
-    sleep_time = depot_sleep_time
-    count = 1
-    driver1 = driver
-    while True:
+
+def exit_on_sigterm(signum, frame):
+    """
+    Turn SIGTERM into a normal exit so that pending writebacks
+    are flushed and the worker pools stopped before the process dies
+    """
+    sys.exit(0)
+
+
+class Blocked(Exception):
+    """The website answered with a captcha or bot check instead of the page"""
+
+
+def report_response(throttle, status, page_source, latency, retry_after=None):
+    """Tell the rate limiter how the website answered, returns True when it blocked us"""
+    from extractors import get_extractor
+
+    blocked = status in BLOCKED_STATUS or get_extractor('wdepot').challenge(page_source)
+    if throttle:
+        if blocked:
+            throttle.blocked(parse_retry_after(retry_after))
+        elif status >= 500:
+            throttle.error()
+        else:
+            throttle.success(latency)
+    return blocked
+
+
+def log_retry(what):
+    """on_retry callback of a RetryPolicy logging the failed attempt"""
+    def on_retry(attempt, error, delay):
+        logger.error("%s failed (attempt %s), retrying in %.1f seconds: %s" % (what, attempt, delay, error))
+    return on_retry
+
+
+def record_failure(breaker, competitor):
+    if breaker.failure():
+        logger.error("%s keeps failing, pausing it for %s seconds" % (breaker.name, breaker.reset_timeout))
+        metrics.inc('circuit_open_total', competitor=competitor)
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and its descendants, 0 when it cannot be read"""
+    if not pid:
+        return 0
+    processes = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
         try:
-            time.sleep(sleep_time)
-            pop_button = driver.find_elements_by_xpath("//button[@class='action-secondary action-dismiss']")
-            if len(pop_button) > 0:
-                pop_button[0].click()
-            my_list = driver.find_element_by_xpath("//button[@class='action action-auth-toggle user-shopping-list']")
-            my_list.click()
-            link = driver.find_element_by_xpath(
-                "//div[@id='header-list-item-count']/div/ol[1]/li[1]/a")  # use li[1] for first list
-            link.click()
-            time.sleep(sleep_time)
-            break
+            with open('/proc/%s/stat' % entry) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the fields after the parenthesized command: state, ppid, ... rss (in pages) is the 22nd
+        fields = stat[stat.rindex(')') + 2:].split()
+        processes[int(entry)] = (int(fields[1]), int(fields[21]))
+    children = {}
+    for process, (ppid, pages) in processes.items():
+        children.setdefault(ppid, []).append(process)
+    tree = [pid] if pid in processes else []
+    rss = 0
+    while tree:
+        process = tree.pop()
+        rss += processes[process][1]
+        tree.extend(children.get(process, []))
+    return rss * os.sysconf('SC_PAGE_SIZE')
+
+
+class DriverManager:
+    """
+    Keeps the browser session of a competitor alive between
+    poll cycles. The cookies are saved in the session directory
+    so that a new browser can restore the login instead of
+    going through the login form again.
+    """
 
+    def __init__(self, competitor, throttle=None):
+        self.competitor = competitor
+        self.throttle = throttle
+        self.driver = None
+        self.uses = 0
+        self.cookie_file = os.path.join(session_dir, competitor + '.json')
 
-        except Exception as er:
-            if count == 3:
-                logger.error("***Restaurant Depot Page loading failed.***")
-                return data
-            logger.error("Restaurant Depot Page loading failed. Retrying...")
-            sleep_time += 15
-            count += 1
-            driver = driver1
+    def healthy(self):
+        try:
+            self.driver.execute_script('return 1')
+            return True
+        except Exception:
+            return False
+
+    def get(self, start_url):
+        """
+        A working driver on start_url, the running one when it still
+        responds and did not outgrow the page or memory limit
+        """
+        if self.driver is not None:
+            reason = self.worn_out()
+            if reason:
+                logger.info("%s browser %s, restarting it" % (self.competitor, reason))
+                metrics.inc('browser_recycles_total', competitor=self.competitor, reason=reason.split()[0])
+                self.save_cookies()
+                self.recycle()
+            elif self.healthy():
+                self.uses += 1
+                return self.driver
+            else:
+                logger.info("%s browser session is not responding, recycling it" % self.competitor)
+                self.recycle()
+
+        from selenium import webdriver
+
+        with metrics.timer('browser_start', competitor=self.competitor):
+            driver = webdriver.Firefox(options=firefox_options(), service_log_path=os.path.devnull)
+
+        # s = Service('/home/pauljose/projects/odoo-nsa/geckodriver')
+        # driver = webdriver.Firefox(service=s)
+        self.driver = driver
+        self.uses = 1
+        metrics.inc('browser_starts_total', competitor=self.competitor)
+        self.restore_cookies(start_url)
+        if self.throttle:
+            self.throttle.wait()
+        with metrics.timer('page_load', competitor=self.competitor):
+            driver.get(start_url)
+        return driver
+
+    def worn_out(self):
+        """Why the driver should be restarted, None while it is fine"""
+        if recycle_pages and self.uses >= recycle_pages:
+            return "served %s SKUs" % self.uses
+        # reading /proc is cheap but not free, so memory is checked every 10th use
+        if recycle_rss and self.uses % 10 == 0:
+            rss = process_tree_rss(self.driver.capabilities.get('moz:processID'))
+            if rss > recycle_rss:
+                return "uses %s MB of memory" % (rss // (1024 * 1024))
+        return None
+
+    def restore_cookies(self, start_url):
+        try:
+            with open(self.cookie_file) as f:
+                cookies = json.load(f)
+        except (OSError, ValueError):
+            return
+        # cookies can only be set on a page of their domain
+        site = urlsplit(start_url)
+        if self.throttle:
+            self.throttle.wait()
+        self.driver.get('%s://%s/robots.txt' % (site.scheme, site.netloc))
+        for cookie in cookies:
+            try:
+                self.driver.add_cookie(cookie)
+            except Exception:
+                pass
 
-    count = 1
-    driver1 = driver
-    while True:
+    def save_cookies(self):
+        if self.driver is None:
+            return
         try:
-            print_button = driver.find_elements_by_xpath("//button[@id='print-export-list']")
-            if len(print_button) > 0:
-                print_button[0].click()
-                time.sleep(depot_sleep_time)
+            os.makedirs(session_dir, exist_ok=True)
+            # workers of one competitor share the cookie file, not the temporary one
+            tmp_file = '%s.%s.tmp' % (self.cookie_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                json.dump(self.driver.get_cookies(), f)
+            os.replace(tmp_file, self.cookie_file)
+        except Exception as e:
+            logger.error("Saving the %s browser session failed: %s" % (self.competitor, e))
+
+    def recycle(self):
+        """Drop the current driver, the next get() starts a new one"""
+        driver, self.driver = self.driver, None
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception:
+                logger.error('Cannot close driver.')
 
-            if os.path.isfile(download_directory + "/Allitems.csv"):
-                os.remove(download_directory + "/Allitems.csv")
+    def quit(self):
+        self.save_cookies()
+        self.recycle()
 
-            export_button = driver.find_elements_by_xpath("//button[@id='export-to-excel']")
 
-            if len(export_button) > 0:
-                export_button[0].click()
-                time.sleep(depot_sleep_time)
-            break
-        except Exception as er:
-            if count == 3:
-                logger.error("***Restaurant Depot export failed.***")
-                return data
-            logger.error("Restaurant Depot export failed. Retrying...")
+def restaurant_depot_login(driver, website_config):
+    """
+    Log in unless the session was restored from the saved cookies.
+    Attempts back off exponentially, the last error is raised.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    login_url, username, password = website_config['rdepot']
+
+    def login():
+        driver.get(login_url)
+        driver.implicitly_wait(0)
+        WebDriverWait(driver, 40).until(EC.presence_of_element_located(
+            (By.XPATH, "//input[@id='email'] | //button[@class='action action-auth-toggle user-shopping-list']")))
+        if not driver.find_elements_by_id('email'):
+            # session restored from the saved cookies
+            return
+        driver.implicitly_wait(40)
+        uname = driver.find_element_by_id('email')
+        uname.clear()
+        uname.send_keys(username)
+
+        pwd = driver.find_element_by_id('pass')
+        pwd.clear()
+        pwd.send_keys(password)
+
+        submit_button = driver.find_element_by_id('send2')
+        submit_button.click()
+
+        driver.implicitly_wait(60)
+
+    LOGIN_RETRY.call(login, on_retry=log_retry("Restaurant Depot login"))
+    return driver
+
+
+def wait_for_download(directory, filename, timeout, settle=1.0, poll=0.5):
+    """
+    Wait until a browser download is complete: the file exists,
+    its .part file is gone and its size did not change for
+    `settle` seconds. Returns False on the deadline.
+    """
+    path = os.path.join(directory, filename)
+    deadline = time.monotonic() + timeout
+    last_size = -1
+    stable_since = time.monotonic()
+    while time.monotonic() < deadline:
+        if not os.path.exists(path + '.part') and os.path.isfile(path):
+            size = os.path.getsize(path)
+            if size != last_size:
+                last_size = size
+                stable_since = time.monotonic()
+            elif size and time.monotonic() - stable_since >= settle:
+                return True
+        time.sleep(poll)
+    return False
+
+
+def restaurant_depot_scrape(driver):
+    """
+    Export the shopping list and return an iterator
+    over its items, None when the export failed
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    sleep_time = depot_sleep_time
+    # explicit waits below, an implicit wait would stall every optional element lookup
+    driver.implicitly_wait(0)
+
+    def slower(what):
+        """Log the failed attempt and give the next one 15 more seconds"""
+        def on_retry(attempt, error, delay):
+            nonlocal sleep_time
+            log_retry(what)(attempt, error, delay)
             sleep_time += 15
-            count += 1
-            driver = driver1
+        return on_retry
+
+    def open_list():
+        wait = WebDriverWait(driver, sleep_time)
+        my_list = wait.until(EC.element_to_be_clickable(
+            (By.XPATH, "//button[@class='action action-auth-toggle user-shopping-list']")))
+        pop_button = driver.find_elements_by_xpath("//button[@class='action-secondary action-dismiss']")
+        if len(pop_button) > 0:
+            pop_button[0].click()
+        my_list.click()
+        link = wait.until(EC.element_to_be_clickable(
+            (By.XPATH, "//div[@id='header-list-item-count']/div/ol[1]/li[1]/a")))  # use li[1] for first list
+        link.click()
+        wait.until(EC.presence_of_element_located(
+            (By.XPATH, "//button[@id='print-export-list' or @id='export-to-excel']")))
+
+    def export_list():
+        wait = WebDriverWait(driver, sleep_time)
+        print_button = driver.find_elements_by_xpath("//button[@id='print-export-list']")
+        if len(print_button) > 0:
+            print_button[0].click()
+
+        # also the partial file of a download that crashed
+        for stale in ("/Allitems.csv", "/Allitems.csv.part"):
+            if os.path.isfile(download_directory + stale):
+                os.remove(download_directory + stale)
+
+        export_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[@id='export-to-excel']")))
+        export_button.click()
+        if not wait_for_download(download_directory, "Allitems.csv", sleep_time):
+            raise TimeoutError("Allitems.csv was not downloaded within %s seconds" % sleep_time)
+
+    try:
+        PAGE_RETRY.call(open_list, on_retry=slower("Restaurant Depot page loading"))
+    except Exception as er:
+        logger.error("***Restaurant Depot Page loading failed.*** %s" % er)
+        return None
+    try:
+        PAGE_RETRY.call(export_list, on_retry=slower("Restaurant Depot export"))
+    except Exception as er:
+        logger.error("***Restaurant Depot export failed.*** %s" % er)
+        return None
 
     if os.path.isfile(download_directory + "/Allitems.csv"):
-        with open(download_directory + "/Allitems.csv", newline='') as f:
-            count = 1
-            old_upc = ''
-            for row in csv.reader(f):
-                if count > 10:
-                    if row[5] == 'Total:':
-                        break
-
-                    if row[7] == 'N/A':
-                        upc = ''
-                        if row[0]:
-                            upc = row[0]
-                            old_upc = row[0]
-                        else:
-                            upc = old_upc
-                        data[upc] = {'not_available': True}
-                        continue
-
-                    qty = float(row[6])
-                    price = float(row[7].strip('$').replace(',', ''))
-                    unit_price = price
-                    if qty > 0:
-                        unit_price = price/qty
-
-                    if not row[0]:
-                        data[old_upc]['case_price'] = unit_price
-                    else:
-                        data[row[0]] = {'name': row[2], 'unit_price': unit_price, 'not_available': False}
-                        old_upc = row[0]
-                count+=1
-
-
-    driver.quit()
-    return data
-
-
-def restaurant_depot(products, website_config):
-
-
-    socket = xmlrpc.client.ServerProxy(url + '/xmlrpc/object', context=ssl._create_unverified_context(), allow_none=True)
-    driver = webdriver.Firefox(options=options, service_log_path=os.path.devnull)
-
-    # s = Service('/home/pauljose/projects/odoo-nsa/geckodriver')
-    # driver = webdriver.Firefox(service=s)
-
-    driver = restaurant_depot_login(driver, website_config)
-    data = restaurant_depot_scrape(driver)
-    # data = {elm.get('upc'): {e: elm[e] for e in list(elm.keys()) if e != 'upc'} for elm in data}
-
-    if 'rdepot' in website_config:
-        for sku in list(products.keys()):
-            if sku in list(data.keys()):  # product found in the scraped list
-                if data[sku].get('not_available', False):
-                    write_except = socket.execute(db, login, pwd, 'product.sku.reference', 'log_exception_error',
-                                                  products[sku][0],
-                                                  "Temporarily unavailable")
-                    continue
-                item_name = data[sku].get('name')
-                item_price = data[sku].get('unit_price')
-                if data[sku].get('case_price'):
-                    item_price = data[sku].get('case_price')
-                logger.info(f"writing info RD sku: {sku} Name:{item_name} Price: {item_price}")
-                create_vals = {'product_sku_ref_id': products[sku][0],
-                               'item_name': item_name,
-                               'item_price': item_price,
-                               'update_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                               }
-
-                res = odoo_writeback(create_vals, products[sku][0])
-
-                schedule_to_unlink = socket.execute(db, login, pwd, 'price.fetch.schedule', 'search',
-                                                    [('product_sku_ref_id', '=', products[sku][0])], 0, 1)
-                unlink_scheduled = schedule_to_unlink and socket.execute(db, login, pwd, 'price.fetch.schedule',
-                                                                         'unlink', schedule_to_unlink)
-
-            else:  # product not found in scraped list log exception
-                write_except = socket.execute(db, login, pwd, 'product.sku.reference', 'log_exception_error',
-                                              products[sku][0],
-                                              "Couldn't fetch price due to unknown reason, please check if the product is added in the scrape list setup in restaurant depot website.")
-    return True
-
-
-def webstaurant_store_fetch(driver, item, products, mode):
+        return read_depot_export(download_directory + "/Allitems.csv")
+    return None
+
+
+def restaurant_depot(products, website_config, session, writeback, breaker):
+    """
+    Price the products from one shopping list export, returns
+    'scraped', or 'failed' when the list could not be exported and
+    the products stay scheduled, or 'circuit_open' when the
+    competitor is paused and the products were marked instead.
+    """
+    if 'rdepot' not in website_config:
+        logger.error('Website Configuration required for Restaurant Depot')
+        return 'failed'
+
+    if not breaker.allow():
+        logger.error(breaker.message)
+        for product in products.values():
+            writeback.add_exception(product[0], breaker.message)
+        metrics.inc('skus_total', len(products), competitor='rdepot', outcome='circuit_open')
+        return 'circuit_open'
+
+    try:
+        driver = session.get(website_config['rdepot'][0])
+        with metrics.timer('login', competitor='rdepot'):
+            driver = restaurant_depot_login(driver, website_config)
+    except Exception as e:
+        logger.error("***Restaurant Depot login failed.*** %s" % e)
+        export = None
+    else:
+        with metrics.timer('export', competitor='rdepot'):
+            export = restaurant_depot_scrape(driver)
+    if export is None:
+        session.recycle()
+        record_failure(breaker, 'rdepot')
+        metrics.inc('skus_total', len(products), competitor='rdepot', outcome='failed')
+        return 'failed'
+    breaker.success()
+    session.save_cookies()
+    with metrics.timer('parse', competitor='rdepot'):
+        data = join_queued(export, products)
+
+    for sku in products:
+        if sku in data:  # product found in the scraped list
+            if data[sku].not_available:
+                writeback.add_exception(products[sku][0], "Temporarily unavailable")
+                metrics.inc('skus_total', competitor='rdepot', outcome='unavailable')
+                continue
+            item_name = data[sku].name
+            item_price = data[sku].case_price or data[sku].unit_price
+            logger.info(f"writing info RD sku: {sku} Name:{item_name} Price: {item_price}")
+            create_vals = {'product_sku_ref_id': products[sku][0],
+                           'item_name': item_name,
+                           'item_price': item_price,
+                           'update_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                           }
+
+            writeback.add_price(create_vals)
+            metrics.inc('skus_total', competitor='rdepot', outcome='scraped')
+
+        else:  # product not found in scraped list log exception
+            metrics.inc('skus_total', competitor='rdepot', outcome='failed')
+            writeback.add_exception(products[sku][0],
+                                    "Couldn't fetch price due to unknown reason, please check if the product is added in the scrape list setup in restaurant depot website.")
+    return 'scraped'
+
+
+def restaurant_depot_worker(work_queue, done_queue, breaker):
+    """Long-lived Restaurant Depot worker, one job is one shopping list export"""
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    metrics.take()
+    session = DriverManager('rdepot')
+    with OdooWriteback(competitor='rdepot') as writeback:
+        def handle(job):
+            products, website_config, schedule_ids = job
+            writeback.schedule_ids.update(schedule_ids)
+            outcome = restaurant_depot(products, website_config, session, writeback, breaker)
+            return list(products), {outcome: len(products)}
+
+        worker_loop(work_queue, done_queue, writeback, handle)
+    session.quit()
+
+
+def webstaurant_store_extract(page_source, url=None):
+    """
+    Read the item name and unit price from a Webstaurant product
+    page. Raises LayoutChanged when the page has no pricing block.
+    """
+    from extractors import get_extractor
+
+    item = get_extractor('wdepot').extract(page_source, url)
+    return item.name, item.unit_price
+
+
+def webstaurant_store_http_fetch(http, item, products, writeback, throttle=None, url=None):
+    """
+    Fetch a known product page over plain HTTP and write its price,
+    returns the URL it landed on. Returns False when the page is gone,
+    blocked or cannot be read without JavaScript, the caller then
+    falls back to the browser.
+    """
+    url = url or products[item][2]
+    if throttle:
+        throttle.wait()
+    start = time.perf_counter()
+    try:
+        with metrics.timer('http_fetch', competitor='wdepot'):
+            response = http.request('GET', url)
+            page_source = response.data.decode('utf-8', 'replace')
+    except Exception as er:
+        if throttle:
+            throttle.error()
+        logger.info(f"Webstaurant page for sku {item} not readable over HTTP, using the browser: {er}")
+        return False
+    blocked = report_response(throttle, response.status, page_source, time.perf_counter() - start,
+                              response.headers.get('Retry-After'))
+    # urllib3 gives the Location header of the last redirect, which may be relative
+    item_url = urljoin(url, response.geturl() or url)
+    if response.status in (404, 410) or response.status == 200 and wrong_product(url, item_url, item):
+        logger.info(f"Webstaurant page {url} of sku {item} is gone or shows another product")
+        index = url_index()
+        if index is not None:
+            index.invalid('wdepot', item, url)
+        return False
+    if response.status != 200 or blocked:
+        logger.info(f"Webstaurant page for sku {item} refused over HTTP ({response.status}), using the browser")
+        return False
+    try:
+        with metrics.timer('parse', competitor='wdepot'):
+            name, unit_price = webstaurant_store_extract(page_source, url)
+    except Exception as er:
+        logger.info(f"Webstaurant page for sku {item} not readable over HTTP, using the browser: {er}")
+        return False
+
+    if not unit_price:
+        return False
+    logger.info(f"writing info WS sku: {item}  Price: {unit_price}")
+    create_vals = {'product_sku_ref_id': products[item][0], 'item_name': name, 'item_price': unit_price,
+                   'update_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    writeback.add_price(create_vals, write_url=item_url if item_url != products[item][2] else '')
+    return item_url
+
+
+def webstaurant_store_fetch(driver, item, products, mode, writeback, throttle=None, url=None):
+    """
+    Price the SKU in the browser, by searching for it or by opening
+    `url` (default its website_link). Returns the product page URL,
+    False when no price was found. WebDriver errors and page timeouts
+    are raised for the caller to retry with a new browser, Blocked
+    when the site answered with a captcha.
+    """
+    from selenium.common.exceptions import WebDriverException
+    from extractors import LayoutChanged
+
     try:
-        unit_price = 0
         product_sku_id = products[item][0]
 
         if mode == 'search':
@@ -308,168 +1088,486 @@ def webstaurant_store_fetch(driver, item, products, mode):
             search_box.send_keys(item)
             search_button = driver.find_element_by_xpath(
                 "//button[@class='text-white hidden rounded-r border-0 box-border text-sm py-2.5 px-4-1/2 lt:flex lt:items-center cursor-pointer bg-blue-700 lt:hover:bg-blue-800 tracking-[.02em]']")
-            search_button.click()
+            if throttle:
+                throttle.wait()
+            start = time.perf_counter()
+            with metrics.timer('page_load', competitor='wdepot'):
+                search_button.click()
 
         if mode == 'url':
-            driver.get(products[item][2])
+            if throttle:
+                throttle.wait()
+            start = time.perf_counter()
+            url = url or products[item][2]
+            with metrics.timer('page_load', competitor='wdepot'):
+                driver.get(url)
 
         driver.implicitly_wait(random.randint(40, 45))
-        item_url = driver.current_url
-
-        soup_level2 = BeautifulSoup(driver.page_source, 'lxml')
-
-        price_tr = soup_level2.findAll('div', {'class': 'pricing'})[0].findAll('tr')
-        price = []
-        name_tag = soup_level2.findAll('h1', {'id': 'page-header-description'})
-        name = False
-        if name_tag:
-            name = name_tag[0].get_text()
-        for tr in price_tr:
-            if tr.find('td'):
-                price.append(
-                    float(tr.find('td').get_text().replace('\n', '').replace('\t', '').split('$')[-1].split('/')[0]))
-        if price:
-            unit_price = max(price)
-        else:
-            price_p = soup_level2.findAll('div', {'class': 'pricing'})[0].findAll('p')
-            if price_p:
-                unit_price = float(price_p[0].get_text().replace('$', '').split('/')[0])
+        # a stage of its own, page_load counts one load per page
+        with metrics.timer('page_source', competitor='wdepot'):
+            item_url = driver.current_url
+            page_source = driver.page_source
+        if report_response(throttle, 200, page_source, time.perf_counter() - start):
+            raise Blocked('Webstaurant is blocking the browser')
+        if mode == 'url' and wrong_product(url, item_url, item):
+            logger.info(f"Webstaurant page {url} of sku {item} shows another product")
+            index = url_index()
+            if index is not None:
+                index.invalid('wdepot', item, url)
+            return False
+
+        with metrics.timer('parse', competitor='wdepot'):
+            name, unit_price = webstaurant_store_extract(page_source, item_url)
 
         if unit_price:
             logger.info(f"writing info WS sku: {item}  Price: {unit_price}")
             create_vals = {'product_sku_ref_id': product_sku_id, 'item_name': name, 'item_price': unit_price,
                            'update_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
             logger.info(f"create_vals: {create_vals}")
-            res = odoo_writeback(create_vals, product_sku_id, write_url=item_url)
-
-            return True
+            writeback.add_price(create_vals, write_url=item_url if item_url != products[item][2] else '')
+
+            return item_url
+    except LayoutChanged as er:
+        logger.error('Competitor SKU %s: %s' % (item, er))
+        if mode == 'url' and er.field == 'pricing block':
+            # not a product page, e.g. a 404, unless the search finds the product there again
+            index = url_index()
+            if index is not None:
+                index.invalid('wdepot', item, url)
+    except Blocked:
+        raise
+    except WebDriverException:
+        if throttle:
+            throttle.error()
+        raise
     except Exception as er:
-        logger.error('----------------------Competitor SKU -------------------:', item)
-        logger.error('Exception occurred', er)
+        if throttle:
+            throttle.error()
+        logger.error('Competitor SKU %s: exception occurred: %s' % (item, er))
     return False
 
 
-def webstaurant_store(products, website_config):
-
-    socket = xmlrpc.client.ServerProxy(url + '/xmlrpc/object', context=ssl._create_unverified_context(), allow_none=True)
-    driver = webdriver.Firefox(options=options, service_log_path=os.path.devnull)
+def webstaurant_store_item(session, http, item, products, website_config, writeback, throttle, breaker):
+    """
+    Scrape one SKU, returns the path that handled it: 'http',
+    'browser', 'failed' when the product could not be priced,
+    'error' when the browser kept failing, 'blocked' when the site
+    kept answering with a captcha, which leaves the SKU scheduled, or
+    'circuit_open' when the browser is not used because of earlier
+    errors.
+
+    A known product page is opened directly, the SKU is only
+    searched when there is none or it does not work anymore.
+    """
+    index = url_index()
 
-    # s = Service('/home/pauljose/projects/odoo-nsa/geckodriver')
-    # driver = webdriver.Firefox(service=s)
-    item_url = ''
-    if 'wdepot' in website_config:
-        login_url = website_config['wdepot'][0]
-        driver.get(login_url)
-        driver.implicitly_wait(random.randint(40, 45))
-        for item in products:
-            res = False
-            write_except = False
-            try:
-                res = webstaurant_store_fetch(driver, item, products, 'search')
-                if not res and products[item][2]:
-                    logger.info("Could not find Webstaurant product in search. Redo the failed SKU with URL")
-                    res = webstaurant_store_fetch(driver, item, products, 'url')
-                random_sleep()
+    def known_url():
+        return index.lookup('wdepot', item, products[item][2]) if index is not None else products[item][2]
 
-            except Exception as e:
+    url = known_url()
+    if http_first and url:
+        item_url = webstaurant_store_http_fetch(http, item, products, writeback, throttle, url)
+        if item_url:
+            if index is not None:
+                index.resolved('wdepot', item, item_url)
+            return 'http'
+        # a 404 or another product dropped it from the index
+        url = known_url()
 
-                # if exception due to timeout, then recreate driver and repeat
-                #                driver.close()
-                driver.quit()
-                logger.info("Closed Driver, Quit driver, Spawning new driver instance.................")
-                driver = webdriver.Firefox(options, service_log_path=os.path.devnull)
-                driver.get(login_url)
-                driver.implicitly_wait(random.randint(40, 45))
-                try:
-                    res = webstaurant_store_fetch(driver, item, products, 'search')
-                    if not res and products[item][2]:
-                        logger.info("Could not find Webstaurant product in search. Redo the failed SKU with URL")
-                        res = webstaurant_store_fetch(driver, item, products, 'url')
-                    random_sleep()
-                except Exception as er:
-                    logger.error('Exception occurred for %s: %s' % (item, er))
-                    write_except = socket.execute(db, login, pwd, 'product.sku.reference', 'log_exception_error',
-                                                  products[item][0], str(er))
-
-            if res:
-                schedule_to_unlink = socket.execute(db, login, pwd, 'price.fetch.schedule', 'search',
-                                                    [('product_sku_ref_id', '=', products[item][0])], 0, 1)
-                unlink_scheduled = schedule_to_unlink and socket.execute(db, login, pwd, 'price.fetch.schedule',
-                                                                         'unlink', schedule_to_unlink)
-            if not res and not write_except:
-                write_except = socket.execute(db, login, pwd, 'product.sku.reference', 'log_exception_error',
-                                              products[item][0],
-                                              "Couldn't fetch price due to unknown reason, please check.")
+    if not breaker.allow():
+        writeback.add_exception(products[item][0], breaker.message)
+        return 'circuit_open'
 
+    login_url = website_config['wdepot'][0]
 
+    def browser_fetch():
+        driver = session.get(login_url)
+        driver.implicitly_wait(random.randint(40, 45))
+        res = False
+        if url:
+            res = webstaurant_store_fetch(driver, item, products, 'url', writeback, throttle, url)
+            if not res:
+                logger.info("Known Webstaurant product page did not work. Search for the SKU instead")
+        if not res:
+            res = webstaurant_store_fetch(driver, item, products, 'search', writeback, throttle)
+        return res
+
+    def recycle(attempt, error, delay):
+        # if exception due to timeout, then recreate driver and repeat
+        log_retry("Webstaurant browser for %s" % item)(attempt, error, delay)
+        session.recycle()
 
-    else:
-        logger.error('Website Configuration required for Webstaurant Store')
     try:
-        #        driver.close()
-        driver.quit()
-    except:
-        logger.error('Cannot close driver. Exiting...')
-
-
-def check_queued_fetches(login_config):
+        res = BROWSER_RETRY.call(browser_fetch, on_retry=recycle)
+    except Blocked as er:
+        logger.error('Competitor SKU %s: %s' % (item, er))
+        record_failure(breaker, 'wdepot')
+        return 'blocked'
+    except Exception as er:
+        logger.error('Exception occurred for %s: %s' % (item, er))
+        writeback.add_exception(products[item][0], str(er))
+        record_failure(breaker, 'wdepot')
+        return 'error'
+
+    if not res:
+        writeback.add_exception(products[item][0],
+                                "Couldn't fetch price due to unknown reason, please check.")
+        return 'failed'
+    breaker.success()
+    if index is not None:
+        index.resolved('wdepot', item, res)
+    return 'browser'
+
+
+def webstaurant_store_worker(work_queue, done_queue, throttle, breaker):
+    """
+    Long-lived Webstaurant worker. All workers pull single SKUs
+    from the same queue, so a slow SKU only holds up its own
+    worker. SKUs with a known product link are tried over plain
+    HTTP first, the browser is only started once a SKU needs it.
+    """
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    metrics.take()
+    session = DriverManager('wdepot', throttle)
+    import urllib3
+    # no retries of our own: a 429 or 503 goes back to the caller, which falls back to the browser
+    # and slows down instead of hitting the site again on every Retry-After
+    http = urllib3.PoolManager(maxsize=1, headers=HTTP_HEADERS, timeout=urllib3.Timeout(**HTTP_TIMEOUT),
+                               retries=urllib3.Retry(total=None, connect=0, read=0, status=0, redirect=5,
+                                                     respect_retry_after_header=False))
+    with OdooWriteback(competitor='wdepot') as writeback:
+        def handle(job):
+            item, product, schedules, website_config = job
+            writeback.schedule_ids[product[0]] = schedules
+            if 'wdepot' not in website_config:
+                logger.error('Website Configuration required for Webstaurant Store')
+                return [item], {'failed': 1}
+            path = webstaurant_store_item(session, http, item, {item: product}, website_config, writeback,
+                                          throttle, breaker)
+            metrics.inc('skus_total', competitor='wdepot', outcome=path)
+            return [item], {path: 1}
+
+        worker_loop(work_queue, done_queue, writeback, handle)
+    http.clear()
+    session.quit()
+
+
+def worker_loop(work_queue, done_queue, writeback, handle):
+    """
+    Run jobs from the work queue until the end marker. Each job
+    comes with its SKUs, which are claimed on the done queue before
+    it runs so the pool knows what this worker holds. Finished
+    SKUs are reported on the done queue only once their writeback
+    went through, which is forced whenever the queue runs dry, so a
+    poll never sees them as queued anymore. The metrics recorded
+    by the worker travel along with its reports.
+    """
+    # (writeback batch, skus, outcome) of the jobs not reported yet
+    finished = []
+    while True:
+        try:
+            job = work_queue.get(timeout=1)
+        except queue.Empty:
+            job = False
+        if job is None:
+            break
+        if job:
+            claimed, job = job
+            done_queue.put((os.getpid(), claimed, None, {}))
+            skus, outcome = handle(job)
+            finished.append((writeback.mark(), skus, outcome))
+        if finished and (not job or work_queue.empty()):
+            writeback.flush()
+        written = [entry for entry in finished if writeback.is_written(entry[0])]
+        if written:
+            finished = finished[len(written):]
+            report(done_queue, written)
+        elif not job and (metrics.counters or metrics.timers):
+            done_queue.put((os.getpid(), [], {}, metrics.take()))
+    writeback.flush()
+    report(done_queue, finished)
+
+
+def report(done_queue, finished):
+    skus = []
+    outcomes = Counter()
+    for mark, job_skus, outcome in finished:
+        skus.extend(job_skus)
+        outcomes.update(outcome)
+    done_queue.put((os.getpid(), skus, dict(outcomes), metrics.take()))
+
+
+class WorkerPool:
+    """
+    Long-lived worker processes of one competitor, kept across
+    polls so their browser sessions stay warm. Jobs go on a shared
+    queue, workers claim the SKUs of the jobs they take and report
+    finished SKUs on a done queue.
+
+    SKUs are tracked while in flight so a SKU is never handed out
+    twice, and per worker once claimed so that a dead worker only
+    releases its own. With `batch` all new SKUs are gathered into one job that
+    dispatch() submits while the pool is idle; otherwise each SKU is
+    a job submitted right away.
+    """
 
-    socket = xmlrpc.client.ServerProxy(url + '/xmlrpc/object', context=ssl._create_unverified_context(), allow_none=True)
+    def __init__(self, name, target, size=1, args=(), batch=False):
+        self.name = name
+        self.target = target
+        self.size = size
+        self.args = args
+        self.batch = batch
+        self.work_queue = mp.Queue()
+        self.done_queue = mp.Queue()
+        self.processes = []
+        self.in_flight = set()
+        # pid -> SKUs claimed by that worker and not reported done yet
+        self.held = {}
+        self.pending = {}
+        self.pending_schedules = {}
+        self.login_config = {}
+        self.report = Counter()
+
+    def ensure_started(self):
+        """
+        Start missing workers, returns how many running ones had died.
+        The SKUs a dead worker held are released, they stay scheduled
+        in Odoo and are picked up again by a later poll.
+        """
+        alive = [process for process in self.processes if process.is_alive()]
+        died = len(self.processes) - len(alive)
+        if died:
+            logger.error("%s %s worker(s) died, restarting" % (died, self.name))
+            for process in self.processes:
+                if process not in alive:
+                    self.in_flight.difference_update(self.held.pop(process.pid, ()))
+        self.processes = alive
+        while len(self.processes) < self.size:
+            process = mp.Process(name="%s-%s" % (self.name, len(self.processes) + 1), target=run_worker,
+                                 args=(settings, self.target, self.work_queue, self.done_queue) + tuple(self.args))
+            process.start()
+            self.processes.append(process)
+        return died
+
+    def schedule(self, products, schedule_ids, login_config):
+        """Queue the products that are not in flight yet, returns how many were new"""
+        new = {sku: product for sku, product in products.items()
+               if sku not in self.in_flight and sku not in self.pending}
+        if self.batch:
+            self.pending.update(new)
+            self.pending_schedules.update({product[0]: schedule_ids.get(product[0], []) for product in new.values()})
+            self.login_config = login_config
+        elif new:
+            self.ensure_started()
+            for item, product in new.items():
+                self.work_queue.put(([item], (item, product, schedule_ids.get(product[0], []), login_config)))
+            self.in_flight.update(new)
+        return len(new)
+
+    def dispatch(self):
+        """Submit the gathered batch once the pool is idle"""
+        if self.pending and not self.in_flight:
+            self.ensure_started()
+            self.work_queue.put((list(self.pending), (self.pending, self.login_config, self.pending_schedules)))
+            self.in_flight.update(self.pending)
+            self.pending = {}
+            self.pending_schedules = {}
+
+    def collect(self):
+        """
+        Take in the claims and the SKUs reported done, and restart
+        dead workers. Only the SKUs of dead workers are released, jobs
+        still queued and the SKUs of the other workers stay in flight.
+        """
+        while True:
+            try:
+                pid, skus, outcome, delta = self.done_queue.get_nowait()
+            except queue.Empty:
+                break
+            if outcome is None:
+                if any(process.pid == pid for process in self.processes):
+                    self.held.setdefault(pid, set()).update(skus)
+                else:
+                    # claimed by a worker that died since
+                    self.in_flight.difference_update(skus)
+                continue
+            self.held.get(pid, set()).difference_update(skus)
+            self.in_flight.difference_update(skus)
+            self.report.update(outcome)
+            metrics.merge(delta)
+        if self.processes:
+            self.ensure_started()
+        if self.report and not self.in_flight:
+            logger.info("%s run: %s" % (self.name, ', '.join('%s %s' % (count, path)
+                                                             for path, count in sorted(self.report.items()))))
+            self.report = Counter()
+
+    def stop(self, timeout=60):
+        """
+        Stop the workers once their current job is written back. Jobs
+        not started yet are dropped, their SKUs stay scheduled in Odoo.
+        Workers still busy after `timeout` seconds are terminated.
+        """
+        try:
+            while True:
+                self.work_queue.get_nowait()
+        except queue.Empty:
+            pass
+        for process in self.processes:
+            self.work_queue.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes = []
+
+
+def check_queued_fetches(after_id=0):
+    """
+    Read the queued fetches with a schedule id above `after_id`
+    in pages of page_size rows, in id order. Yields for every page
+    its highest schedule id, the schedule ids of each
+    product_sku_ref_id and the queued products of each competitor
+    keyed by competitor SKU.
+
+    The SKU references of a page are read together with the next
+    page of the queue. That is one request with system.multicall,
+    which Odoo does not register, so against Odoo the two calls run
+    concurrently on the pooled connections and a page costs about
+    the slower of the two calls.
+    """
     logger.info('polling queue')
-    queued_fetches = socket.execute(db, login, pwd, 'price.fetch.schedule', 'search_read', [('in_exception', '=', False)],
-                                    ['id', 'product_sku_ref_id'])
-    queued_fetches_ids = [ele['id'] for ele in queued_fetches]
-    queued_fetches = [ele['product_sku_ref_id'][0] for ele in queued_fetches]
-    rdepot_skus = socket.execute(db, login, pwd, 'product.sku.reference', 'search_read',
-                                 [('id', 'in', queued_fetches), ('competitor', '=', 'rdepot'),
-                                  ('in_exception', '=', False)], ['id', 'competitor_sku', 'website_link', 'qty_in_uom'])
-
-    wdepot_skus = socket.execute(db, login, pwd, 'product.sku.reference', 'search_read',
-                                 [('id', 'in', queued_fetches), ('competitor', '=', 'wdepot'),
-                                  ('in_exception', '=', False)], ['id', 'competitor_sku', 'website_link', 'qty_in_uom'])
-    rdepot_products = {}
-    rdepot_products = {sku['competitor_sku']: (sku['id'], sku['qty_in_uom'], sku['website_link']) for sku in
-                       rdepot_skus}
-    wdepot_products = {sku['competitor_sku']: (sku['id'], sku['qty_in_uom'], sku['website_link']) for sku in
-                       wdepot_skus}
-
-
-    # Start Webstaurant Scraping if we have products in the queue
-    logger.info('***Webstaurant Scraping***')
-    webstaurant_worker = None
-    if wdepot_products:
-        webstaurant_worker = mp.Process(name="Webstaurant", target=webstaurant_store,
-                                        args=(wdepot_products, login_config))
-        webstaurant_worker.start()
-    else:
-        logger.info('No Webstaurant product in the queue')
+    domain = [('in_exception', '=', False), ('product_sku_ref_id.in_exception', '=', False),
+              ('product_sku_ref_id.competitor', 'in', ['rdepot', 'wdepot'])]
+    fields = ['id', 'product_sku_ref_id']
+    queued_fetches = odoo().execute('price.fetch.schedule', 'search_read', domain + [('id', '>', after_id)],
+                                    fields, 0, page_size, 'id asc')
+    while queued_fetches:
+        last_id = queued_fetches[-1]['id']
+        schedule_ids = {}
+        for ele in queued_fetches:
+            schedule_ids.setdefault(ele['product_sku_ref_id'][0], []).append(ele['id'])
+        calls = [('product.sku.reference', 'read', list(schedule_ids.keys()),
+                  ['id', 'competitor', 'competitor_sku', 'website_link', 'qty_in_uom'])]
+        if len(queued_fetches) == page_size:
+            calls.append(('price.fetch.schedule', 'search_read', domain + [('id', '>', last_id)],
+                          fields, 0, page_size, 'id asc'))
+        skus, *next_page = odoo().multicall(calls)
+        queued_fetches = next_page[0] if next_page else []
+
+        products = {'rdepot': {}, 'wdepot': {}}
+        for sku in skus:
+            products[sku['competitor']][sku['competitor_sku']] = (sku['id'], sku['qty_in_uom'], sku['website_link'])
+        yield last_id, schedule_ids, products
+
+
+class Scheduler:
+    """
+    Feeds the competitor worker pools continuously. Polls only read
+    schedule rows newer than the last one seen, quickly while work
+    keeps arriving and backing off to poll_interval when idle. The
+    whole queue is re-read every poll_interval to pick up rows that
+    were left behind, e.g. after a failed writeback.
+    """
 
-    # logger.info('***Restaurant Depot Scraping***')
+    def __init__(self, pools):
+        self.pools = pools
+        self.last_id = 0
+        self.next_full_poll = 0
+        self.interval = min_poll_interval
+        self.login_config = {}
+
+    def load_login_config(self):
+        website_config = odoo().execute('website.scraping.cofig', 'search_read', [],
+                                        ['id', 'home_page_url', 'username', 'password', 'competitor'])
+        login_config = {config['competitor']: (config['home_page_url'], config['username'], config['password'])
+                        for config in website_config}
+        if not login_config:
+            logger.error('Website configuration required')
+            sys.exit(1)
+        self.login_config = login_config
+
+    def poll(self):
+        """
+        Dispatch the newly queued SKUs page by page as they are
+        read, returns how many there were
+        """
+        if time.monotonic() >= self.next_full_poll:
+            if self.next_full_poll:
+                logger.info("metrics: %s" % json.dumps(metrics.summary()))
+            self.load_login_config()
+            self.last_id = 0
+            self.next_full_poll = time.monotonic() + poll_interval
+        new = 0
+        for last_id, schedule_ids, products in check_queued_fetches(self.last_id):
+            self.last_id = last_id
+            for competitor, pool in self.pools.items():
+                new += pool.schedule(products.get(competitor, {}), schedule_ids, self.login_config)
+        for pool in self.pools.values():
+            pool.dispatch()
+        if new:
+            logger.info('%s new SKUs queued for scraping' % new)
+        return new
+
+    def run(self):
+        while True:
+            for pool in self.pools.values():
+                pool.collect()
+            try:
+                with metrics.timer('poll'):
+                    new = self.poll()
+            except (OSError, xmlrpc.client.Error) as e:
+                logger.error("Polling the queue failed: %s" % e)
+                new = 0
+            if new:
+                self.interval = min_poll_interval
+            else:
+                self.interval = min(self.interval * 2, poll_interval)
+            time.sleep(self.interval)
+
+
+def run_worker(args, target, *target_args):
+    """
+    Entry point of the worker processes. Unless forked they start
+    without the settings and logging of the main process.
+    """
+    if not logger.handlers:
+        setup_logging()
+    configure(args)
+    target(*target_args)
+
+
+def main(argv=None):
+    setup_logging()
+    configure(parse_args(argv))
+    mp.set_start_method(start_method)
+    if start_method == 'fork':
+        import multiprocessing_logging
+        multiprocessing_logging.install_mp_handler(logger=logger)
+    elif start_method == 'forkserver':
+        mp.set_forkserver_preload(list(dict.fromkeys(['__main__', __name__] + PRELOAD)))
+
+    webstaurant_limiter = AdaptiveRateLimiter(1 / host_interval if host_interval > 0 else float('inf'),
+                                              1 / max_host_interval if max_host_interval > 0 else 0,
+                                              competitor='wdepot')
+    webstaurant_pool = WorkerPool("Webstaurant", webstaurant_store_worker, size=max(1, workers),
+                                  args=(webstaurant_limiter,
+                                        CircuitBreaker("Webstaurant Store", breaker_threshold, breaker_reset)))
+    depot_pool = WorkerPool("Restaurant_Depot", restaurant_depot_worker, batch=True,
+                            args=(CircuitBreaker("Restaurant Depot", breaker_threshold, breaker_reset),))
+
+    if metrics_port:
+        serve_metrics(metrics, metrics_port)
+    warm_price_cache()
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    try:
+        Scheduler({'wdepot': webstaurant_pool, 'rdepot': depot_pool}).run()
+    finally:
+        for pool in (webstaurant_pool, depot_pool):
+            pool.stop()
 
-    restaurant_depot_worker = None
-    if rdepot_products:
-        restaurant_depot_worker = mp.Process(name="Restaurant_Depot", target=restaurant_depot,
-                                             args=(rdepot_products, login_config))
-        restaurant_depot_worker.start()
-    else:
-        logger.info('No Restaurant Depot product in the queue')
-
-    # Wait for workers to finish their jobs
-    if webstaurant_worker:
-        webstaurant_worker.join()
-    if restaurant_depot_worker:
-        restaurant_depot_worker.join()
-    return list(rdepot_products.keys()), list(wdepot_products.keys())
-
-
-socket = xmlrpc.client.ServerProxy(url + '/xmlrpc/object', context=ssl._create_unverified_context(), allow_none=True)
-while True:
-    website_config = socket.execute(db, login, pwd, 'website.scraping.cofig', 'search_read', [],
-                                    ['id', 'home_page_url', 'username', 'password', 'competitor'])
-    login_config = {config['competitor']: (config['home_page_url'], config['username'], config['password']) for config
-                    in website_config}
-    if not login_config:
-        logger.error('Website configuration required')
-        sys.exit(1)
-    rdepot_keys, wdepot_keys = check_queued_fetches(login_config)
-    time.sleep(poll_interval)
+
+if __name__ == '__main__':
+    main()